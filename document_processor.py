@@ -1,124 +1,302 @@
 import os
+import re
+import json
+import hashlib
+import pickle
 import logging
-from typing import List, Dict, Any
+import multiprocessing
+from collections import Counter
+from typing import List, Dict, Any, Optional, Tuple, Iterable, Iterator, Callable
 from pathlib import Path
-import PyPDF2
+from functools import lru_cache
+from itertools import groupby
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from transformers import AutoTokenizer
+from huggingface_hub import hf_hub_download
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
 from config import Config
+from pdf_extraction import init_worker, extract_pages
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Directory for cached PDF extraction results; bump the version when the
+# cached format changes
+CACHE_DIR = ".cache"
+CACHE_VERSION = 3
+
+# Sentence-transformers models truncate input beyond their max_seq_length
+# (256 word pieces for the default all-MiniLM-L6-v2, including [CLS] and
+# [SEP]), so larger chunks would only be partially embedded. The limit is read
+# from the model's sentence_bert_config.json; this is the fallback when the
+# model doesn't declare one and its tokenizer reports no usable limit either.
+DEFAULT_MAX_SEQ_LENGTH = 512
+SENTENCE_TRANSFORMERS_CONFIG = "sentence_bert_config.json"
+
+# Compiled once; used by preprocess_text
+_WHITESPACE_RE = re.compile(r"\s+")
+_NULLS_RE = re.compile(r"\x00+")
+
+# Extraction workers are started from a clean process rather than forked from
+# this multi-threaded one; forkserver is cheaper per worker where available
+_WORKER_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+def _page_documents(pages: List[str], metadata: Dict[str, Any]) -> Iterator[Document]:
+    """One Document per non-empty page, tagged with its 1-based page number"""
+    for page_number, text in enumerate(pages, start=1):
+        text = text.strip()
+        if text:
+            yield Document(page_content=text, metadata={**metadata, "page": page_number})
+
+def _max_seq_length(tokenizer) -> int:
+    """Number of tokens, special tokens included, the embedding model reads per input"""
+    try:
+        if os.path.isdir(Config.EMBEDDING_MODEL):
+            config_path = os.path.join(Config.EMBEDDING_MODEL, SENTENCE_TRANSFORMERS_CONFIG)
+        else:
+            config_path = hf_hub_download(Config.EMBEDDING_MODEL, SENTENCE_TRANSFORMERS_CONFIG)
+        with open(config_path, "r", encoding="utf-8") as f:
+            return int(json.load(f)["max_seq_length"])
+    except Exception as e:
+        logger.warning(f"No max_seq_length declared for {Config.EMBEDDING_MODEL}, using the tokenizer's limit: {e}")
+    
+    # Tokenizers without a limit report a huge sentinel value
+    limit = tokenizer.model_max_length
+    return limit if limit <= 100_000 else DEFAULT_MAX_SEQ_LENGTH
+
+def _source_of(doc: Document) -> Optional[str]:
+    """Source file a document or page was extracted from"""
+    return doc.metadata.get("source")
+
+def _with_chunk_metadata(chunk: Document, chunk_id: int, total_chunks: int,
+                         length_function: Callable[[str], int]) -> Document:
+    """Set chunk bookkeeping fields in place (no temporary dict per chunk).
+    
+    chunk_size is measured by the splitter's length function, so it is in
+    the processor's chunk_unit.
+    """
+    metadata = chunk.metadata
+    metadata["chunk_id"] = chunk_id
+    metadata["total_chunks"] = total_chunks
+    metadata["chunk_size"] = length_function(chunk.page_content)
+    return chunk
+
 class DocumentProcessor:
     """Handles PDF document processing, extraction, and chunking"""
     
-    def __init__(self):
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=Config.CHUNK_SIZE,
-            chunk_overlap=Config.CHUNK_OVERLAP,
-            length_function=len,
-            separators=["\n\n", "\n", " ", ""]
+    def __init__(self, max_workers: int = None):
+        # Effective chunking, set by _create_text_splitter: sizes are in
+        # embedding-model tokens, or characters if the tokenizer can't be loaded
+        self.chunk_size = Config.CHUNK_SIZE
+        self.chunk_overlap = Config.CHUNK_OVERLAP
+        self.chunk_unit = "characters"
+        self.length_function = len
+        self.text_splitter = self._create_text_splitter()
+        # Number of worker processes used for PDF extraction
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.cache_dir = Path(CACHE_DIR)
+    
+    def _create_text_splitter(self) -> RecursiveCharacterTextSplitter:
+        """Create a splitter that measures chunks in embedding-model tokens"""
+        separators = ["\n\n", "\n", " ", ""]
+        try:
+            tokenizer = AutoTokenizer.from_pretrained(Config.EMBEDDING_MODEL)
+        except Exception as e:
+            logger.warning(f"Failed to load tokenizer for {Config.EMBEDDING_MODEL}, splitting by characters: {e}")
+            return RecursiveCharacterTextSplitter(
+                chunk_size=Config.CHUNK_SIZE,
+                chunk_overlap=Config.CHUNK_OVERLAP,
+                length_function=len,
+                separators=separators
+            )
+        
+        # The recursive splitter measures the same pieces repeatedly while
+        # merging, so memoize token counts instead of re-encoding each time
+        @lru_cache(maxsize=1024)
+        def token_length(text: str) -> int:
+            return len(tokenizer.encode(text, add_special_tokens=False))
+        
+        # Token counts above exclude special tokens, which also count
+        # against the model's max_seq_length
+        max_tokens = _max_seq_length(tokenizer) - tokenizer.num_special_tokens_to_add()
+        self.chunk_size = min(Config.CHUNK_SIZE, max_tokens)
+        self.chunk_overlap = self.chunk_size * Config.CHUNK_OVERLAP // Config.CHUNK_SIZE
+        self.chunk_unit = "tokens"
+        self.length_function = token_length
+        logger.info(f"Chunking with {Config.EMBEDDING_MODEL} tokenizer: {self.chunk_size} tokens, {self.chunk_overlap} overlap")
+        
+        return RecursiveCharacterTextSplitter(
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap,
+            length_function=token_length,
+            separators=separators
         )
     
     def extract_text_from_pdf(self, pdf_path: str) -> str:
         """Extract text content from a PDF file"""
         try:
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-                return text.strip()
+            return "\n".join(extract_pages(pdf_path)).strip()
         except Exception as e:
             logger.error(f"Error extracting text from {pdf_path}: {e}")
             raise
     
-    def process_pdf_documents(self, data_dir: str = None) -> List[Document]:
-        """Process all PDF documents in the data directory"""
+    def _cache_path(self, pdf_file: Path, stat: os.stat_result) -> Path:
+        """Cache file for a PDF, keyed by its path, modification time and size"""
+        key = hashlib.blake2b(f"{CACHE_VERSION}:{pdf_file}:{stat.st_mtime_ns}:{stat.st_size}".encode()).hexdigest()
+        return self.cache_dir / f"{key}.pkl"
+    
+    def _load_cached(self, cache_path: Path) -> Optional[Tuple[List[str], Dict[str, Any]]]:
+        """Load cached (pages, metadata) for a PDF, or None on a cache miss"""
+        try:
+            with open(cache_path, 'rb') as file:
+                return pickle.load(file)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable cache entry {cache_path}: {e}")
+            return None
+    
+    def _store_cached(self, cache_path: Path, pages: List[str], metadata: Dict[str, Any]) -> None:
+        """Write (pages, metadata) for a PDF to the cache"""
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_path.with_suffix(".tmp")
+            with open(tmp_path, 'wb') as file:
+                pickle.dump((pages, metadata), file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+        except Exception as e:
+            logger.warning(f"Failed to cache extracted text for {metadata.get('source')}: {e}")
+    
+    def iter_pdf_documents(self, data_dir: str = None) -> Iterator[Document]:
+        """Lazily yield one Document per PDF page in the data directory as each file is extracted"""
         if data_dir is None:
             data_dir = Config.DATA_DIR
         
-        documents = []
         pdf_files = list(Path(data_dir).glob("*.pdf"))
         
         logger.info(f"Found {len(pdf_files)} PDF files to process")
         
+        if not pdf_files:
+            return
+        
+        # Unchanged files are served from the extraction cache
+        pending = []
         for pdf_file in pdf_files:
             try:
+                cache_path = self._cache_path(pdf_file, pdf_file.stat())
+            except OSError as e:
+                logger.error(f"Failed to process {pdf_file.name}: {e}")
+                continue
+            
+            cached = self._load_cached(cache_path)
+            if cached is not None:
+                logger.info(f"Using cached text for {pdf_file.name}")
+                pages, metadata = cached
+                yield from _page_documents(pages, metadata)
+            else:
+                pending.append((pdf_file, cache_path))
+        
+        if not pending:
+            return
+        
+        # Each PDF is independent, so extract them in parallel across processes.
+        # This process runs Streamlit, the agent loop and torch thread pools,
+        # so workers are never forked from it; they only import pdf_extraction.
+        workers = min(self.max_workers, len(pending))
+        context = multiprocessing.get_context(_WORKER_START_METHOD)
+        if _WORKER_START_METHOD == "forkserver":
+            # Preload only the worker module in the server, not __main__
+            context.set_forkserver_preload(["pdf_extraction"])
+        worker_counter = context.Value("i", 0)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                 initializer=init_worker, initargs=(worker_counter,)) as executor:
+            futures = {}
+            for pdf_file, cache_path in pending:
                 logger.info(f"Processing {pdf_file.name}")
-                text = self.extract_text_from_pdf(str(pdf_file))
-                
-                # Create document with metadata
-                doc = Document(
-                    page_content=text,
-                    metadata={
+                futures[executor.submit(extract_pages, str(pdf_file))] = (pdf_file, cache_path)
+            
+            for future in as_completed(futures):
+                pdf_file, cache_path = futures.pop(future)
+                try:
+                    pages = future.result()
+                    
+                    # Create document with metadata
+                    metadata = {
                         "source": pdf_file.name,
                         "file_path": str(pdf_file),
                         "file_size": pdf_file.stat().st_size,
                         "type": "pdf"
                     }
-                )
-                documents.append(doc)
+                    self._store_cached(cache_path, pages, metadata)
+                    
+                except Exception as e:
+                    logger.error(f"Failed to process {pdf_file.name}: {e}")
+                    continue
                 
-            except Exception as e:
-                logger.error(f"Failed to process {pdf_file.name}: {e}")
-                continue
+                yield from _page_documents(pages, metadata)
+    
+    def process_pdf_documents(self, data_dir: str = None) -> List[Document]:
+        """Process all PDF documents in the data directory"""
+        return list(self.iter_pdf_documents(data_dir))
+    
+    def _split_document(self, doc: Document) -> List[Document]:
+        """Split a single document or page into chunks"""
+        try:
+            return self.text_splitter.split_documents([doc])
+        except Exception as e:
+            logger.error(f"Error chunking document {doc.metadata.get('source', 'unknown')}: {e}")
+            return []
+    
+    def _split_source(self, docs: Iterable[Document]) -> List[Document]:
+        """Split the pages of one source, numbering chunks across all of its pages"""
+        chunks = [chunk for doc in docs for chunk in self._split_document(doc)]
+        total_chunks = len(chunks)
+        
+        # Add chunk metadata
+        return [_with_chunk_metadata(chunk, i, total_chunks, self.length_function)
+                for i, chunk in enumerate(chunks)]
+    
+    def iter_chunks(self, data_dir: str = None) -> Iterator[Document]:
+        """Lazily yield chunks, splitting each PDF's pages as soon as it is extracted.
         
-        return documents
+        The whole-document text is never assembled; chunks carry their page
+        number, and chunk_id/total_chunks count chunks across the whole PDF.
+        """
+        for _, pages in groupby(self.iter_pdf_documents(data_dir), key=_source_of):
+            yield from self._split_source(pages)
     
-    def chunk_documents(self, documents: List[Document]) -> List[Document]:
-        """Split documents into chunks for vector storage"""
-        logger.info(f"Chunking {len(documents)} documents")
+    def chunk_documents(self, documents: Iterable[Document]) -> List[Document]:
+        """Split documents into chunks for vector storage.
         
+        Consecutive documents from the same source (e.g. its pages) share one chunk numbering.
+        """
         chunked_docs = []
-        for doc in documents:
-            try:
-                chunks = self.text_splitter.split_documents([doc])
-                
-                # Add chunk metadata
-                for i, chunk in enumerate(chunks):
-                    chunk.metadata.update({
-                        "chunk_id": i,
-                        "total_chunks": len(chunks),
-                        "chunk_size": len(chunk.page_content)
-                    })
-                
-                chunked_docs.extend(chunks)
-                
-            except Exception as e:
-                logger.error(f"Error chunking document {doc.metadata.get('source', 'unknown')}: {e}")
-                continue
+        for _, docs in groupby(documents, key=_source_of):
+            chunked_docs.extend(self._split_source(docs))
         
         logger.info(f"Created {len(chunked_docs)} chunks")
         return chunked_docs
     
     def preprocess_text(self, text: str) -> str:
         """Clean and preprocess extracted text"""
-        # Remove excessive whitespace
-        text = " ".join(text.split())
-        
-        # Remove special characters that might interfere with processing
-        text = text.replace('\x00', '')
-        
-        return text.strip()
+        # Remove special characters that might interfere with processing,
+        # then collapse excessive whitespace
+        return _WHITESPACE_RE.sub(" ", _NULLS_RE.sub("", text)).strip()
     
     def get_document_summary(self, documents: List[Document]) -> Dict[str, Any]:
         """Generate summary statistics for processed documents"""
         total_chunks = len(documents)
-        total_text_length = sum(len(doc.page_content) for doc in documents)
-        
-        sources = {}
+        total_text_length = 0
+        sources = Counter()
         for doc in documents:
-            source = doc.metadata.get('source', 'unknown')
-            if source not in sources:
-                sources[source] = 0
-            sources[source] += 1
+            total_text_length += len(doc.page_content)
+            sources[doc.metadata.get('source', 'unknown')] += 1
         
         return {
-            "total_documents": len(set(doc.metadata.get('source') for doc in documents)),
+            "total_documents": len(sources),
             "total_chunks": total_chunks,
             "total_text_length": total_text_length,
             "average_chunk_length": total_text_length / total_chunks if total_chunks > 0 else 0,
-            "sources": sources
+            "sources": dict(sources)
         }
@@ -0,0 +1,203 @@
+import os
+import asyncio
+import logging
+import threading
+from typing import Dict, List
+import httpx
+import numpy as np
+from langchain.schema.embeddings import Embeddings
+from config import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Exported and quantized ONNX models are kept here between runs
+ONNX_CACHE_DIR = os.path.join(".cache", "onnx")
+ONNX_QUANTIZED_FILE = "model_quantized.onnx"
+
+# text-embeddings-inference server used by the "tei" backend, and the most
+# inputs it accepts per request (its --max-client-batch-size default)
+TEI_URL = os.getenv("TEI_URL", "http://localhost:8080")
+TEI_BATCH_SIZE = 32
+
+EMBEDDING_BACKENDS = ("huggingface", "onnx", "tei", "fastembed")
+
+# Backend used when none is given
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "huggingface")
+
+# Inter-op threads for torch; intra-op threads use every CPU available to the process
+TORCH_INTEROP_THREADS = 2
+
+def _configure_torch_threads() -> None:
+    """Let torch CPU inference use all available cores with oneDNN kernels"""
+    import torch
+    
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    torch.set_num_threads(cpus or 1)
+    try:
+        torch.set_num_interop_threads(TORCH_INTEROP_THREADS)
+    except RuntimeError:
+        # Only settable before torch starts any parallel work
+        pass
+    torch.backends.mkldnn.enabled = True
+
+class ONNXEmbeddings(Embeddings):
+    """Sentence-transformer embeddings run through ONNX Runtime with int8 dynamic quantization.
+
+    Produces the same mean-pooled, L2-normalized vectors as the
+    sentence-transformers pipeline of the configured model.
+    """
+
+    def __init__(self, model_name: str, batch_size: int = 32):
+        # Optional dependencies: pip install "optimum[onnxruntime]"
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        from transformers import AutoTokenizer
+
+        self.batch_size = batch_size
+        export_dir = os.path.join(ONNX_CACHE_DIR, model_name.replace("/", "__"))
+        quantized_path = os.path.join(export_dir, ONNX_QUANTIZED_FILE)
+
+        # Export and quantize once; later runs load the cached int8 model
+        if not os.path.exists(quantized_path):
+            logger.info(f"Exporting {model_name} to ONNX with int8 quantization")
+            model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+            model.save_pretrained(export_dir)
+            AutoTokenizer.from_pretrained(model_name).save_pretrained(export_dir)
+            quantize_dynamic(
+                os.path.join(export_dir, "model.onnx"),
+                quantized_path,
+                weight_type=QuantType.QInt8
+            )
+
+        self.model = ORTModelForFeatureExtraction.from_pretrained(export_dir, file_name=ONNX_QUANTIZED_FILE)
+        self.tokenizer = AutoTokenizer.from_pretrained(export_dir)
+        logger.info(f"Loaded quantized ONNX embedding model from {export_dir}")
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        """Mean-pooled, normalized embeddings for one batch of texts"""
+        inputs = self.tokenizer(texts, padding=True, truncation=True, return_tensors="np")
+        token_embeddings = self.model(**inputs).last_hidden_state
+        mask = inputs["attention_mask"][..., None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of texts"""
+        vectors = [
+            self._embed(texts[start:start + self.batch_size])
+            for start in range(0, len(texts), self.batch_size)
+        ]
+        return np.concatenate(vectors).tolist() if vectors else []
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a single query"""
+        return self._embed([text])[0].tolist()
+
+class TEIEmbeddings(Embeddings):
+    """Client for a text-embeddings-inference server serving the embedding model.
+
+    The server does dynamic batching across concurrent requests. Start it with
+    docker run -p 8080:80 ghcr.io/huggingface/text-embeddings-inference:cpu-latest --model-id <model>
+    """
+
+    def __init__(self, base_url: str = TEI_URL, batch_size: int = TEI_BATCH_SIZE):
+        self.url = f"{base_url.rstrip('/')}/embed"
+        self.batch_size = batch_size
+        self._client = httpx.Client(timeout=60.0)
+
+    def _batches(self, texts: List[str]) -> List[List[str]]:
+        """Split texts into request-sized batches"""
+        return [texts[start:start + self.batch_size] for start in range(0, len(texts), self.batch_size)]
+
+    def _payload(self, texts: List[str]) -> Dict:
+        """Request body; normalized like the sentence-transformers pipeline"""
+        return {"inputs": texts, "normalize": True, "truncate": True}
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of texts"""
+        vectors = []
+        for batch in self._batches(texts):
+            response = self._client.post(self.url, json=self._payload(batch))
+            response.raise_for_status()
+            vectors.extend(response.json())
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a single query"""
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of texts, sending all batches concurrently"""
+        async with httpx.AsyncClient(timeout=60.0) as client:
+            async def embed(batch: List[str]) -> List[List[float]]:
+                response = await client.post(self.url, json=self._payload(batch))
+                response.raise_for_status()
+                return response.json()
+
+            results = await asyncio.gather(*(embed(batch) for batch in self._batches(texts)))
+        return [vector for batch_vectors in results for vector in batch_vectors]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Embed a single query"""
+        return (await self.aembed_documents([text]))[0]
+
+class FastEmbedEmbeddings(Embeddings):
+    """Embeddings from FastEmbed's pre-quantized ONNX models, with no PyTorch dependency"""
+
+    def __init__(self, model_name: str, batch_size: int = 256):
+        # Optional dependency: pip install fastembed
+        from fastembed import TextEmbedding
+
+        self.batch_size = batch_size
+        self.model = TextEmbedding(model_name=model_name)
+        logger.info(f"Loaded FastEmbed model {model_name}")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of texts"""
+        return [vector.tolist() for vector in self.model.embed(texts, batch_size=self.batch_size)]
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a single query"""
+        return next(iter(self.model.query_embed(text))).tolist()
+    
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed several queries in one batch, with the model's query prefix"""
+        return [vector.tolist() for vector in self.model.query_embed(texts, batch_size=self.batch_size)]
+
+def create_embeddings(backend: str = EMBEDDING_BACKEND) -> Embeddings:
+    """Embedding model for Config.EMBEDDING_MODEL on the given backend"""
+    if backend == "huggingface":
+        # Imported here so the other backends never load torch
+        import torch
+        from langchain_huggingface import HuggingFaceEmbeddings
+        
+        if torch.cuda.is_available():
+            # Half-precision weights run on the GPU's tensor cores
+            model_kwargs = {'device': 'cuda', 'model_kwargs': {'torch_dtype': torch.float16}}
+        else:
+            _configure_torch_threads()
+            model_kwargs = {'device': 'cpu'}
+        logger.info(f"Loading embedding model on {model_kwargs['device']}")
+        return HuggingFaceEmbeddings(
+            model_name=Config.EMBEDDING_MODEL,
+            model_kwargs=model_kwargs
+        )
+    if backend == "onnx":
+        return ONNXEmbeddings(Config.EMBEDDING_MODEL)
+    if backend == "tei":
+        return TEIEmbeddings()
+    if backend == "fastembed":
+        return FastEmbedEmbeddings(Config.EMBEDDING_MODEL)
+    raise ValueError(f"Unknown embedding backend {backend!r}, expected one of {EMBEDDING_BACKENDS}")
+
+# Loaded models shared by every VectorStore in the process, per backend
+_EMBEDDINGS: Dict[str, Embeddings] = {}
+_EMBEDDINGS_LOCK = threading.Lock()
+
+def get_embeddings(backend: str = EMBEDDING_BACKEND) -> Embeddings:
+    """Shared embedding model for the backend, loaded on first use"""
+    with _EMBEDDINGS_LOCK:
+        if backend not in _EMBEDDINGS:
+            _EMBEDDINGS[backend] = create_embeddings(backend)
+        return _EMBEDDINGS[backend]
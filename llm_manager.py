@@ -1,14 +1,101 @@
+import atexit
+import asyncio
 import logging
-from typing import Optional, Dict, Any
+import threading
+import weakref
+from typing import Optional, Dict, Any, List, Tuple, Callable, Awaitable, Iterator
+import httpx
+import openai
+import google.generativeai as genai
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_openai import ChatOpenAI
 from langchain_ollama import ChatOllama
-from langchain.schema import HumanMessage, SystemMessage
+from langchain.prompts import PromptTemplate
+from pydantic import BaseModel, Field
 from config import Config
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Keep-alive HTTP/2 connection pools shared by the OpenAI clients, so the
+# several LLM hops of one query reuse warm TLS connections. An async pool is
+# bound to the event loop that first uses it, so there is one per loop: the RAG
+# agent's background loop, or a caller's own loop awaiting the async APIs.
+_HTTP_TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32)
+_HTTP = httpx.Client(http2=True, timeout=_HTTP_TIMEOUT, limits=_HTTP_LIMITS)
+atexit.register(_HTTP.close)
+_HTTP_ASYNC = weakref.WeakKeyDictionary()
+_HTTP_ASYNC_LOCK = threading.Lock()
+
+def _async_http_client() -> httpx.AsyncClient:
+    """Async connection pool of the running event loop, created on first use"""
+    loop = asyncio.get_running_loop()
+    with _HTTP_ASYNC_LOCK:
+        client = _HTTP_ASYNC.get(loop)
+        if client is None:
+            client = _HTTP_ASYNC[loop] = httpx.AsyncClient(http2=True, timeout=_HTTP_TIMEOUT, limits=_HTTP_LIMITS)
+    return client
+
+async def aclose_http_client() -> None:
+    """Close the running event loop's async connection pool; await before the loop shuts down"""
+    with _HTTP_ASYNC_LOCK:
+        client = _HTTP_ASYNC.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+# How long Ollama keeps the local model loaded after a request. Keeping it
+# resident avoids reloading weights between the hops of one query and lets
+# the server reuse the KV cache for the shared prompt prefix.
+OLLAMA_KEEP_ALIVE = "30m"
+
+MEDICAL_PROMPT = """You are a medical AI assistant. Please provide a comprehensive, accurate, and evidence-based response to the following medical query.
+
+Query: {query}
+
+Context from medical documents:
+{context}
+
+Please provide a detailed response that:
+1. Directly addresses the query
+2. References specific information from the provided context
+3. Maintains medical accuracy and professionalism
+4. Includes relevant source citations where possible
+
+Response:"""
+
+EVALUATION_PROMPT = """Evaluate the quality of this medical AI response:
+
+Query: {query}
+
+Response: {response}
+
+Context used: {context}
+
+Rate the response on:
+1. Relevance to the query (0-10)
+2. Accuracy of medical information (0-10)
+3. Use of provided context (0-10)
+4. Overall helpfulness (0-10)
+
+Provide a brief assessment and overall score (0-10):"""
+
+class EvalResult(BaseModel):
+    """Structured quality evaluation returned by the evaluator LLM"""
+    relevance: int = Field(description="Relevance to the query (0-10)")
+    accuracy: int = Field(description="Accuracy of medical information (0-10)")
+    context_use: int = Field(description="Use of provided context (0-10)")
+    overall: float = Field(description="Overall helpfulness score (0-10)")
+    assessment: str = Field(description="Brief assessment of the response")
+    
+    def summary(self) -> str:
+        """Human-readable assessment with the individual scores"""
+        return (
+            f"{self.assessment}\n\n"
+            f"Relevance: {self.relevance}/10, Accuracy: {self.accuracy}/10, "
+            f"Context use: {self.context_use}/10, Overall: {self.overall}/10"
+        )
+
 class LLMManager:
     """Manages different LLM providers with fallback mechanisms"""
     
@@ -17,6 +104,16 @@ class LLMManager:
         self.openai_llm = None
         self.ollama_llm = None
         self.current_llm = None
+        self.current_provider = None
+        # Native SDK clients used on the hot path instead of the LangChain wrappers
+        self._raw_clients = {}
+        # Async OpenAI SDK clients per event loop, each on that loop's connection pool
+        self._openai_async_clients = weakref.WeakKeyDictionary()
+        # Structured-output evaluators, created per provider on first use
+        self._evaluators = {}
+        # Prompt templates are parsed once and reused for every call
+        self._medical_tmpl = PromptTemplate.from_template(MEDICAL_PROMPT)
+        self._evaluation_tmpl = PromptTemplate.from_template(EVALUATION_PROMPT)
         self.initialize_llms()
     
     def initialize_llms(self):
@@ -30,6 +127,14 @@ class LLMManager:
                     temperature=Config.TEMPERATURE,
                     max_tokens=Config.MAX_TOKENS
                 )
+                genai.configure(api_key=Config.GOOGLE_API_KEY)
+                self._raw_clients["google"] = genai.GenerativeModel(
+                    Config.DEFAULT_MODEL,
+                    generation_config={
+                        "temperature": Config.TEMPERATURE,
+                        "max_output_tokens": Config.MAX_TOKENS
+                    }
+                )
                 logger.info(f"Initialized Google Gemini LLM with model: {Config.DEFAULT_MODEL}")
             
             # Initialize OpenAI
@@ -38,8 +143,10 @@ class LLMManager:
                     openai_api_key=Config.OPENAI_API_KEY,
                     model=Config.FALLBACK_MODEL,
                     temperature=Config.TEMPERATURE,
-                    max_tokens=Config.MAX_TOKENS
+                    max_tokens=Config.MAX_TOKENS,
+                    http_client=_HTTP
                 )
+                self._raw_clients["openai"] = openai.OpenAI(api_key=Config.OPENAI_API_KEY, http_client=_HTTP)
                 logger.info(f"Initialized OpenAI LLM with model: {Config.FALLBACK_MODEL}")
             
             # Initialize Ollama (local)
@@ -47,7 +154,8 @@ class LLMManager:
                 self.ollama_llm = ChatOllama(
                     model=Config.OLLAMA_MODEL,
                     base_url=Config.OLLAMA_BASE_URL,
-                    temperature=Config.TEMPERATURE
+                    temperature=Config.TEMPERATURE,
+                    keep_alive=OLLAMA_KEEP_ALIVE
                 )
                 logger.info(f"Initialized Ollama LLM with model: {Config.OLLAMA_MODEL}")
             except Exception as e:
@@ -61,6 +169,56 @@ class LLMManager:
             logger.error(f"Error initializing LLMs: {e}")
             # Try to fallback to any available LLM
             self.current_llm = self.openai_llm or self.ollama_llm
+        
+        self.current_provider = next(
+            (name for name, llm in self._available_providers() if llm is self.current_llm), None
+        )
+    
+    def _available_providers(self) -> List[Tuple[str, Any]]:
+        """Initialized LLMs as (provider, llm) pairs in preference order"""
+        providers = [("google", self.google_llm), ("openai", self.openai_llm), ("ollama", self.ollama_llm)]
+        return [(name, llm) for name, llm in providers if llm]
+    
+    def _invoke(self, provider: str, llm: Any, prompt: str) -> str:
+        """Send a single-turn prompt, calling the native SDK directly when available"""
+        raw_client = self._raw_clients.get(provider)
+        if provider == "google" and raw_client is not None:
+            return raw_client.generate_content(prompt).text
+        if provider == "openai" and raw_client is not None:
+            completion = raw_client.chat.completions.create(
+                model=Config.FALLBACK_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=Config.TEMPERATURE,
+                max_tokens=Config.MAX_TOKENS
+            )
+            return completion.choices[0].message.content
+        # LangChain chat models accept a plain string as a single human message
+        return llm.invoke(prompt).content
+    
+    def _openai_async_client(self) -> openai.AsyncOpenAI:
+        """Async OpenAI client for the running event loop"""
+        loop = asyncio.get_running_loop()
+        client = self._openai_async_clients.get(loop)
+        if client is None:
+            client = openai.AsyncOpenAI(api_key=Config.OPENAI_API_KEY, http_client=_async_http_client())
+            self._openai_async_clients[loop] = client
+        return client
+    
+    async def _ainvoke(self, provider: str, llm: Any, prompt: str) -> str:
+        """Async counterpart of _invoke"""
+        if provider == "google" and "google" in self._raw_clients:
+            response = await self._raw_clients["google"].generate_content_async(prompt)
+            return response.text
+        if provider == "openai" and "openai" in self._raw_clients:
+            completion = await self._openai_async_client().chat.completions.create(
+                model=Config.FALLBACK_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=Config.TEMPERATURE,
+                max_tokens=Config.MAX_TOKENS
+            )
+            return completion.choices[0].message.content
+        response = await llm.ainvoke(prompt)
+        return response.content
     
     def get_llm(self, provider: str = "auto") -> Optional[Any]:
         """Get LLM instance for specified provider"""
@@ -74,40 +232,36 @@ class LLMManager:
             return self.current_llm
         return None
     
-    def generate_response(self, prompt: str, provider: str = "auto") -> Dict[str, Any]:
-        """Generate response using specified or best available LLM"""
+    def _call_with_fallbacks(self, provider: str, call: Callable[[str, Any], Any]) -> Dict[str, Any]:
+        """Run call(provider_name, llm) on the requested LLM, falling back to the others in order"""
         try:
             llm = self.get_llm(provider)
             if not llm:
                 return {"success": False, "error": "No LLM available"}
             
+            name = self.current_provider if provider == "auto" else provider
+            
             # Try the specified provider first
             try:
-                response = llm.invoke([HumanMessage(content=prompt)])
+                response = call(name, llm)
                 return {
                     "success": True,
-                    "response": response.content,
+                    "response": response,
                     "provider": provider if provider != "auto" else "auto-selected"
                 }
             except Exception as e:
                 logger.warning(f"Primary LLM failed, trying fallbacks: {e}")
                 
                 # Try fallback providers
-                fallback_providers = []
-                if provider != "google" and self.google_llm:
-                    fallback_providers.append(("google", self.google_llm))
-                if provider != "openai" and self.openai_llm:
-                    fallback_providers.append(("openai", self.openai_llm))
-                if provider != "ollama" and self.ollama_llm:
-                    fallback_providers.append(("ollama", self.ollama_llm))
+                fallback_providers = [(n, l) for n, l in self._available_providers() if n != name]
                 
                 for fallback_name, fallback_llm in fallback_providers:
                     try:
-                        response = fallback_llm.invoke([HumanMessage(content=prompt)])
+                        response = call(fallback_name, fallback_llm)
                         logger.info(f"Successfully used fallback LLM: {fallback_name}")
                         return {
                             "success": True,
-                            "response": response.content,
+                            "response": response,
                             "provider": f"fallback-{fallback_name}"
                         }
                     except Exception as fallback_e:
@@ -117,53 +271,154 @@ class LLMManager:
                 return {"success": False, "error": "All LLM providers failed"}
                 
         except Exception as e:
-            logger.error(f"Error in generate_response: {e}")
+            logger.error(f"Error calling LLM: {e}")
+            return {"success": False, "error": str(e)}
+    
+    async def _acall_with_fallbacks(self, provider: str, call: Callable[[str, Any], Awaitable[Any]]) -> Dict[str, Any]:
+        """Async _call_with_fallbacks; fallback providers are queried concurrently"""
+        try:
+            llm = self.get_llm(provider)
+            if not llm:
+                return {"success": False, "error": "No LLM available"}
+            
+            name = self.current_provider if provider == "auto" else provider
+            
+            # Try the specified provider first
+            try:
+                response = await call(name, llm)
+                return {
+                    "success": True,
+                    "response": response,
+                    "provider": provider if provider != "auto" else "auto-selected"
+                }
+            except Exception as e:
+                logger.warning(f"Primary LLM failed, trying fallbacks: {e}")
+                return await self._arace_fallbacks(name, call)
+                
+        except Exception as e:
+            logger.error(f"Error calling LLM: {e}")
             return {"success": False, "error": str(e)}
     
+    async def _arace_fallbacks(self, failed_provider: str, call: Callable[[str, Any], Awaitable[Any]]) -> Dict[str, Any]:
+        """Run call on all remaining providers and return the first success"""
+        tasks = {
+            asyncio.ensure_future(call(name, llm)): name
+            for name, llm in self._available_providers() if name != failed_provider
+        }
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # Prefer providers in configured order when several finish together
+                for task in [t for t in tasks if t in done]:
+                    fallback_name = tasks[task]
+                    if task.exception() is None:
+                        logger.info(f"Successfully used fallback LLM: {fallback_name}")
+                        return {
+                            "success": True,
+                            "response": task.result(),
+                            "provider": f"fallback-{fallback_name}"
+                        }
+                    logger.warning(f"Fallback LLM {fallback_name} failed: {task.exception()}")
+        finally:
+            for task in pending:
+                task.cancel()
+        
+        return {"success": False, "error": "All LLM providers failed"}
+    
+    def generate_response(self, prompt: str, provider: str = "auto") -> Dict[str, Any]:
+        """Generate response using specified or best available LLM"""
+        return self._call_with_fallbacks(provider, lambda name, llm: self._invoke(name, llm, prompt))
+    
+    async def agenerate_response(self, prompt: str, provider: str = "auto") -> Dict[str, Any]:
+        """Async generate_response; fallback providers are queried concurrently"""
+        return await self._acall_with_fallbacks(provider, lambda name, llm: self._ainvoke(name, llm, prompt))
+    
+    def stream_response(self, prompt: str, provider: str = "auto") -> Iterator[str]:
+        """Yield response text chunks as they are generated.
+        
+        Falls back to the next provider only if one fails before producing any
+        text; a failure mid-stream is raised to the caller.
+        """
+        llm = self.get_llm(provider)
+        if not llm:
+            raise RuntimeError("No LLM available")
+        
+        name = self.current_provider if provider == "auto" else provider
+        candidates = [(name, llm)] + [(n, l) for n, l in self._available_providers() if n != name]
+        
+        for candidate_name, candidate_llm in candidates:
+            started = False
+            try:
+                for chunk in candidate_llm.stream(prompt):
+                    if chunk.content:
+                        started = True
+                        yield chunk.content
+                return
+            except Exception as e:
+                if started:
+                    raise
+                logger.warning(f"Streaming from {candidate_name} failed, trying fallbacks: {e}")
+        
+        raise RuntimeError("All LLM providers failed")
+    
+    def stream_medical_response(self, query: str, context: str) -> Iterator[str]:
+        """Streaming generate_medical_response"""
+        return self.stream_response(self._medical_tmpl.format(query=query, context=context))
+    
     def generate_medical_response(self, query: str, context: str) -> Dict[str, Any]:
         """Generate medical-specific response with context"""
-        medical_prompt = f"""You are a medical AI assistant. Please provide a comprehensive, accurate, and evidence-based response to the following medical query.
-
-Query: {query}
-
-Context from medical documents:
-{context}
-
-Please provide a detailed response that:
-1. Directly addresses the query
-2. References specific information from the provided context
-3. Maintains medical accuracy and professionalism
-4. Includes relevant source citations where possible
-
-Response:"""
-        
-        return self.generate_response(medical_prompt)
+        return self.generate_response(self._medical_tmpl.format(query=query, context=context))
+    
+    async def agenerate_medical_response(self, query: str, context: str) -> Dict[str, Any]:
+        """Async generate_medical_response"""
+        return await self.agenerate_response(self._medical_tmpl.format(query=query, context=context))
+    
+    def _evaluator(self, provider: str, llm: Any) -> Any:
+        """LLM bound to the EvalResult schema, cached per provider"""
+        if provider not in self._evaluators:
+            self._evaluators[provider] = llm.with_structured_output(EvalResult)
+        return self._evaluators[provider]
+    
+    def _evaluate(self, provider: str, llm: Any, prompt: str) -> EvalResult:
+        """Run the structured evaluation on one provider"""
+        result = self._evaluator(provider, llm).invoke(prompt)
+        if result is None:
+            raise ValueError(f"{provider} returned no parseable evaluation")
+        return result
+    
+    async def _aevaluate(self, provider: str, llm: Any, prompt: str) -> EvalResult:
+        """Async _evaluate"""
+        result = await self._evaluator(provider, llm).ainvoke(prompt)
+        if result is None:
+            raise ValueError(f"{provider} returned no parseable evaluation")
+        return result
+    
+    def _evaluation_result(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Convert a structured evaluation call result into the public result dict"""
+        if not result["success"]:
+            return result
+        scores = result["response"]
+        return {
+            "success": True,
+            "evaluation": scores.summary(),
+            "score": scores.overall
+        }
     
     def evaluate_response_quality(self, query: str, response: str, context: str) -> Dict[str, Any]:
-        """Evaluate the quality of a generated response"""
-        evaluation_prompt = f"""Evaluate the quality of this medical AI response:
-
-Query: {query}
-
-Response: {response}
-
-Context used: {context}
-
-Rate the response on:
-1. Relevance to the query (0-10)
-2. Accuracy of medical information (0-10)
-3. Use of provided context (0-10)
-4. Overall helpfulness (0-10)
-
-Provide a brief assessment and overall score (0-10):"""
+        """Evaluate the quality of a generated response.
         
-        result = self.generate_response(evaluation_prompt)
-        if result["success"]:
-            return {
-                "success": True,
-                "evaluation": result["response"]
-            }
-        return result
+        The score (0-10) is read from a structured LLM output rather than parsed from free text.
+        """
+        prompt = self._evaluation_tmpl.format(query=query, response=response, context=context)
+        result = self._call_with_fallbacks("auto", lambda name, llm: self._evaluate(name, llm, prompt))
+        return self._evaluation_result(result)
+    
+    async def aevaluate_response_quality(self, query: str, response: str, context: str) -> Dict[str, Any]:
+        """Async evaluate_response_quality"""
+        prompt = self._evaluation_tmpl.format(query=query, response=response, context=context)
+        result = await self._acall_with_fallbacks("auto", lambda name, llm: self._aevaluate(name, llm, prompt))
+        return self._evaluation_result(result)
     
     def get_available_models(self) -> Dict[str, Any]:
         """Get information about available LLM models"""
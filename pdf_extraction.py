@@ -0,0 +1,30 @@
+import os
+from typing import List
+import pypdfium2 as pdfium
+
+# Entry points for the PDF extraction worker processes. Workers are started
+# with forkserver/spawn and import this module, so it imports nothing beyond
+# pypdfium2: no langchain, transformers or torch in every worker.
+
+def init_worker(worker_counter) -> None:
+    """Process pool initializer: pin each worker to its own CPU"""
+    with worker_counter.get_lock():
+        worker_id = worker_counter.value
+        worker_counter.value += 1
+
+    # CPU affinity is only available on Linux
+    if hasattr(os, "sched_setaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+        os.sched_setaffinity(0, {cpus[worker_id % len(cpus)]})
+
+def _normalize_newlines(text: str) -> str:
+    """pdfium breaks lines with CRLF; the text splitter's separators expect LF"""
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+def extract_pages(pdf_path: str) -> List[str]:
+    """Extract the text of each page of a PDF file"""
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        return [_normalize_newlines(page.get_textpage().get_text_range()) for page in pdf]
+    finally:
+        pdf.close()
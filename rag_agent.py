@@ -1,36 +1,204 @@
+import atexit
+import asyncio
 import logging
+import threading
+from collections import OrderedDict
+from io import StringIO
+from dataclasses import dataclass, field
 from typing import Dict, Any, List, Optional
 from langchain.schema import Document
+from langchain.prompts import PromptTemplate
 from langgraph.graph import StateGraph, END
-from pydantic import BaseModel, Field
 from config import Config
 from vector_store import VectorStore
-from llm_manager import LLMManager
+from llm_manager import LLMManager, aclose_http_client
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class AgentState(BaseModel):
-    """State object for the RAG agent workflow"""
-    query: str = Field(description="The user's query")
-    retrieved_documents: List[Document] = Field(default_factory=list, description="Retrieved relevant documents")
-    context: str = Field(default="", description="Processed context from documents")
-    response: str = Field(default="", description="Generated response")
-    confidence: float = Field(default=0.0, description="Confidence score for the response")
-    sources: List[str] = Field(default_factory=list, description="Source documents used")
-    evaluation: Dict[str, Any] = Field(default_factory=dict, description="Response quality evaluation")
-    error: str = Field(default="", description="Any error messages")
-    step: str = Field(default="start", description="Current step in the workflow")
-    improvement_count: int = Field(default=0, description="Number of times the response has been improved")
+# Upper bound on queries from one process_queries batch running the workflow at once
+MAX_CONCURRENT_QUERIES = 4
+
+# Number of (query, top_k) retrieval results kept per agent
+RETRIEVAL_CACHE_SIZE = 128
+
+ANALYSIS_PROMPT = """Analyze this medical query and determine:
+1. Query type (factual, analytical, comparative, etc.)
+2. Required information depth
+3. Potential challenges or ambiguities
+4. Recommended approach for response generation
+
+Query: {query}
+
+Context available: {num_chunks} document chunks
+
+Provide a brief analysis:"""
+
+IMPROVEMENT_PROMPT = """The previous response to this query received a low confidence score.
+Please improve the response by addressing any identified issues.
+
+Original Query: {query}
+
+Previous Response: {response}
+
+Evaluation Feedback: {feedback}
+
+Context: {context}
+
+Please provide an improved, more accurate, and comprehensive response:"""
+
+# Queries mentioning any of these get the separate analysis LLM call
+# (the corpus is largely German, so German equivalents are included)
+ANALYSIS_KEYWORDS = ("compare", "versus", "differential", "contrast", "vergleich", "unterschied", "gegenüber")
+
+def _needs_analysis(query: str) -> bool:
+    """Whether a query is long or comparative enough to warrant query analysis"""
+    lowered = query.lower()
+    return len(query.split()) > 20 or any(word in lowered for word in ANALYSIS_KEYWORDS)
+
+# Number of leading characters compared when detecting duplicate chunk text
+DEDUPE_PREFIX_CHARS = 256
+
+def _dedupe_documents(documents: List[Document]) -> List[Document]:
+    """Drop repeated chunks: same (source, page, chunk_id), or identical leading text"""
+    seen_ids = set()
+    seen_content = set()
+    unique = []
+    for doc in documents:
+        chunk_key = (doc.metadata.get('source'), doc.metadata.get('page'), doc.metadata.get('chunk_id'))
+        content_key = hash(doc.page_content[:DEDUPE_PREFIX_CHARS])
+        if content_key in seen_content or (chunk_key[2] is not None and chunk_key in seen_ids):
+            continue
+        seen_ids.add(chunk_key)
+        seen_content.add(content_key)
+        unique.append(doc)
+    return unique
+
+def _format_context(documents: List[Document]) -> str:
+    """Join retrieved chunks into the prompt context, each headed by its source"""
+    buffer = StringIO()
+    for doc in documents:
+        buffer.write("Source: ")
+        buffer.write(str(doc.metadata.get('source', 'unknown')))
+        if 'page' in doc.metadata:
+            buffer.write(", page ")
+            buffer.write(str(doc.metadata['page']))
+        buffer.write(" (Chunk ")
+        buffer.write(str(doc.metadata.get('chunk_id', 'unknown')))
+        buffer.write(")\n")
+        buffer.write(doc.page_content)
+        buffer.write("\n\n")
+    return buffer.getvalue()
+
+def _drop_assessment(state: "AgentState", reason: str) -> None:
+    """Forget the previous assessment after a failed evaluation.
+    
+    It describes an earlier response, so improving on it again would only
+    repeat stale feedback; without it _should_improve ends the workflow.
+    """
+    state.evaluation.pop("quality_assessment", None)
+    state.evaluation["evaluation_error"] = reason
+
+# Event loop shared by all agents; LLM calls from every query run on it
+_loop = None
+_loop_lock = threading.Lock()
+
+def _close_loop_clients() -> None:
+    """Close the shared loop's HTTP connection pool at interpreter exit"""
+    try:
+        asyncio.run_coroutine_threadsafe(aclose_http_client(), _loop).result(timeout=5)
+    except Exception as e:
+        logger.warning(f"Could not close the agent loop's HTTP clients: {e}")
+
+def _run_async(coro):
+    """Run a coroutine on the shared background event loop and wait for its result"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="rag-agent-loop", daemon=True).start()
+            atexit.register(_close_loop_clients)
+    return asyncio.run_coroutine_threadsafe(coro, _loop).result()
+
+@dataclass(slots=True)
+class AgentState:
+    """State object for the RAG agent workflow.
+    
+    A plain slotted dataclass: LangGraph reads and writes it on every node
+    transition, so per-assignment validation would only add overhead.
+    """
+    query: str  # The user's query
+    retrieved_documents: List[Document] = field(default_factory=list)  # Retrieved relevant documents
+    context: str = ""  # Processed context from documents
+    response: str = ""  # Generated response
+    confidence: float = 0.0  # Confidence score for the response
+    sources: List[str] = field(default_factory=list)  # Source documents used
+    evaluation: Dict[str, Any] = field(default_factory=dict)  # Response quality evaluation
+    error: str = ""  # Any error messages
+    step: str = "start"  # Current step in the workflow
+    improvement_count: int = 0  # Number of times the response has been improved
+    top_k: Optional[int] = None  # Documents to retrieve (Config.TOP_K_RETRIEVAL if unset)
+    confidence_threshold: Optional[float] = None  # Improve below this (Config.CONFIDENCE_THRESHOLD if unset)
 
 class RAGAgent:
     """Agentic RAG system using LangGraph for autonomous decision-making"""
     
-    def __init__(self):
-        self.vector_store = VectorStore()
+    def __init__(self, vector_store: Optional[VectorStore] = None):
+        if vector_store is None:
+            vector_store = VectorStore()
+            vector_store.load_existing_vector_store()
+        self.vector_store = vector_store
+        # LRU of (query, top_k, store generation) -> retrieved documents
+        self._retrieval_cache = OrderedDict()
+        self._retrieval_cache_lock = threading.Lock()
         self.llm_manager = LLMManager()
+        self._analysis_tmpl = PromptTemplate.from_template(ANALYSIS_PROMPT)
+        self._improvement_tmpl = PromptTemplate.from_template(IMPROVEMENT_PROMPT)
         self.workflow = self._build_workflow()
     
+    def refresh_retriever(self, vector_store: VectorStore) -> None:
+        """Point retrieval at a rebuilt vector store, keeping the LLM clients and workflow"""
+        self.vector_store = vector_store
+        with self._retrieval_cache_lock:
+            self._retrieval_cache.clear()
+        logger.info("RAG agent retriever refreshed")
+    
+    def _retrieve(self, query: str, top_k: Optional[int]) -> tuple:
+        """Memoized similarity search for one query"""
+        return self._retrieve_batch([query], top_k)[0]
+    
+    def _retrieve_batch(self, queries: List[str], top_k: Optional[int] = None) -> List[tuple]:
+        """Similarity search for several queries through the retrieval cache.
+        
+        Cached results are served directly and the distinct misses are searched
+        in one batch. Empty results are not cached, since similarity_search
+        also returns [] on errors. Keys include the store's generation, so
+        results from before documents were added are never served.
+        """
+        top_k = top_k or Config.TOP_K_RETRIEVAL
+        generation = self.vector_store.generation
+        keys = [(query, top_k, generation) for query in queries]
+        
+        with self._retrieval_cache_lock:
+            results = {key: self._retrieval_cache[key] for key in keys if key in self._retrieval_cache}
+            for key in results:
+                self._retrieval_cache.move_to_end(key)
+        
+        missing = [key[0] for key in dict.fromkeys(keys) if key not in results]
+        if missing:
+            if len(missing) == 1:
+                found = [self.vector_store.similarity_search(missing[0], k=top_k)]
+            else:
+                found = self.vector_store.similarity_search_batch(missing, k=top_k)
+            computed = {(query, top_k, generation): tuple(documents) for query, documents in zip(missing, found)}
+            results.update(computed)
+            with self._retrieval_cache_lock:
+                self._retrieval_cache.update((key, documents) for key, documents in computed.items() if documents)
+                while len(self._retrieval_cache) > RETRIEVAL_CACHE_SIZE:
+                    self._retrieval_cache.popitem(last=False)
+        
+        return [results[key] for key in keys]
+    
     def _build_workflow(self) -> StateGraph:
         """Build the LangGraph workflow for agentic behavior"""
         
@@ -63,30 +231,29 @@ class RAGAgent:
         
         return workflow.compile()
     
-    def _retrieve_documents(self, state: AgentState) -> AgentState:
+    async def _retrieve_documents(self, state: AgentState) -> AgentState:
         """Retrieve relevant documents for the query"""
         try:
             state.step = "retrieve"
             logger.info(f"Retrieving documents for query: {state.query}")
             
-            # Perform similarity search
-            documents = self.vector_store.similarity_search(state.query)
+            # Documents may already be supplied by a batched retrieval (process_queries);
+            # otherwise search off the event loop so other queries keep running
+            documents = state.retrieved_documents
+            if not documents:
+                documents = list(await asyncio.to_thread(self._retrieve, state.query, state.top_k))
             
             if not documents:
                 state.error = "No relevant documents found"
                 return state
             
+            # Duplicate chunks only add prompt tokens to every LLM hop
+            documents = _dedupe_documents(documents)
             state.retrieved_documents = documents
             state.sources = [doc.metadata.get('source', 'unknown') for doc in documents]
             
             # Create context from retrieved documents
-            context_parts = []
-            for doc in documents:
-                source = doc.metadata.get('source', 'unknown')
-                chunk_id = doc.metadata.get('chunk_id', 'unknown')
-                context_parts.append(f"Source: {source} (Chunk {chunk_id})\n{doc.page_content}\n")
-            
-            state.context = "\n".join(context_parts)
+            state.context = _format_context(documents)
             logger.info(f"Retrieved {len(documents)} documents")
             
         except Exception as e:
@@ -95,26 +262,26 @@ class RAGAgent:
         
         return state
     
-    def _analyze_query(self, state: AgentState) -> AgentState:
+    async def _analyze_query(self, state: AgentState) -> AgentState:
         """Analyze the query to determine the best approach"""
         try:
             state.step = "analyze"
+            
+            # The analysis only informs the evaluation details, so skip the
+            # extra LLM round-trip for short factual queries
+            if not _needs_analysis(state.query):
+                logger.info("Simple query, skipping query analysis")
+                return state
+            
             logger.info("Analyzing query complexity and requirements")
             
             # Use LLM to analyze query complexity
-            analysis_prompt = f"""Analyze this medical query and determine:
-1. Query type (factual, analytical, comparative, etc.)
-2. Required information depth
-3. Potential challenges or ambiguities
-4. Recommended approach for response generation
-
-Query: {state.query}
-
-Context available: {len(state.retrieved_documents)} document chunks
-
-Provide a brief analysis:"""
+            analysis_prompt = self._analysis_tmpl.format(
+                query=state.query,
+                num_chunks=len(state.retrieved_documents)
+            )
             
-            analysis_result = self.llm_manager.generate_response(analysis_prompt)
+            analysis_result = await self.llm_manager.agenerate_response(analysis_prompt)
             
             if analysis_result["success"]:
                 logger.info("Query analysis completed")
@@ -129,7 +296,7 @@ Provide a brief analysis:"""
         
         return state
     
-    def _generate_response(self, state: AgentState) -> AgentState:
+    async def _generate_response(self, state: AgentState) -> AgentState:
         """Generate initial response using retrieved context"""
         try:
             state.step = "generate"
@@ -140,7 +307,7 @@ Provide a brief analysis:"""
                 return state
             
             # Generate medical response
-            response_result = self.llm_manager.generate_medical_response(
+            response_result = await self.llm_manager.agenerate_medical_response(
                 query=state.query,
                 context=state.context
             )
@@ -159,7 +326,7 @@ Provide a brief analysis:"""
         
         return state
     
-    def _evaluate_response(self, state: AgentState) -> AgentState:
+    async def _evaluate_response(self, state: AgentState) -> AgentState:
         """Evaluate the quality and relevance of the generated response"""
         try:
             state.step = "evaluate"
@@ -170,7 +337,7 @@ Provide a brief analysis:"""
                 return state
             
             # Evaluate response quality
-            evaluation_result = self.llm_manager.evaluate_response_quality(
+            evaluation_result = await self.llm_manager.aevaluate_response_quality(
                 query=state.query,
                 response=state.response,
                 context=state.context
@@ -179,64 +346,59 @@ Provide a brief analysis:"""
             if evaluation_result["success"]:
                 state.evaluation["quality_assessment"] = evaluation_result["evaluation"]
                 
-                # Extract confidence score from evaluation
-                # This is a simplified approach - in practice you might want more sophisticated scoring
-                if "confidence" in evaluation_result["evaluation"].lower():
-                    state.confidence = 0.9
-                elif "good" in evaluation_result["evaluation"].lower():
-                    state.confidence = 0.8
-                elif "adequate" in evaluation_result["evaluation"].lower():
-                    state.confidence = 0.6
-                else:
-                    state.confidence = 0.5
+                # Overall score (0-10) from the structured evaluation
+                state.confidence = max(0.0, min(1.0, evaluation_result["score"] / 10))
                 
                 logger.info(f"Response evaluation completed. Confidence: {state.confidence}")
             else:
                 logger.warning("Response evaluation failed")
                 state.confidence = 0.5  # Default confidence
+                _drop_assessment(state, evaluation_result.get("error", "Evaluation failed"))
                 
         except Exception as e:
             state.error = f"Error in response evaluation: {str(e)}"
             logger.error(f"Response evaluation error: {e}")
             state.confidence = 0.5
+            _drop_assessment(state, str(e))
         
         return state
     
     def _should_improve(self, state: AgentState) -> str:
         """Determine if response should be improved based on evaluation"""
+        # Without an assessment there is no feedback to improve on, and the
+        # confidence is only a default; don't spend LLM calls on it
+        if state.error or not state.evaluation.get("quality_assessment"):
+            logger.info("No usable evaluation, ending workflow")
+            return "end"
+        
         # Limit improvements to prevent infinite recursion
         if state.improvement_count >= 3:
             logger.info(f"Maximum improvement attempts ({state.improvement_count}) reached, ending workflow")
             return "end"
         
-        if state.confidence < Config.CONFIDENCE_THRESHOLD:
-            state.improvement_count += 1
-            logger.info(f"Low confidence ({state.confidence}), improving response (attempt {state.improvement_count}/3)")
+        if state.confidence < state.confidence_threshold:
+            logger.info(f"Low confidence ({state.confidence}), improving response (attempt {state.improvement_count + 1}/3)")
             return "improve"
         else:
             logger.info(f"Confidence ({state.confidence}) meets threshold, ending workflow")
             return "end"
     
-    def _improve_response(self, state: AgentState) -> AgentState:
+    async def _improve_response(self, state: AgentState) -> AgentState:
         """Improve the response based on evaluation feedback"""
         try:
             state.step = "improve"
+            # Counted here: state changes made in the routing function are not persisted
+            state.improvement_count += 1
             logger.info("Improving response based on evaluation")
             
-            improvement_prompt = f"""The previous response to this query received a low confidence score.
-Please improve the response by addressing any identified issues.
-
-Original Query: {state.query}
-
-Previous Response: {state.response}
-
-Evaluation Feedback: {state.evaluation.get('quality_assessment', 'No specific feedback available')}
-
-Context: {state.context}
-
-Please provide an improved, more accurate, and comprehensive response:"""
+            improvement_prompt = self._improvement_tmpl.format(
+                query=state.query,
+                response=state.response,
+                feedback=state.evaluation.get('quality_assessment', 'No specific feedback available'),
+                context=state.context
+            )
             
-            improvement_result = self.llm_manager.generate_response(improvement_prompt)
+            improvement_result = await self.llm_manager.agenerate_response(improvement_prompt)
             
             if improvement_result["success"]:
                 state.response = improvement_result["response"]
@@ -251,16 +413,54 @@ Please provide an improved, more accurate, and comprehensive response:"""
         
         return state
 
-    def process_query(self, query: str) -> Dict[str, Any]:
-        """Process a user query through the complete RAG workflow"""
+    def process_query(self, query: str, top_k: Optional[int] = None,
+                      confidence_threshold: Optional[float] = None) -> Dict[str, Any]:
+        """Process a user query through the complete RAG workflow.
+        
+        top_k and confidence_threshold override the Config defaults for this query only.
+        """
+        return _run_async(self.aprocess_query(query, top_k=top_k, confidence_threshold=confidence_threshold))
+
+    def process_queries(self, queries: List[str]) -> List[Dict[str, Any]]:
+        """Process several queries concurrently; results are returned in input order"""
+        return _run_async(self.aprocess_queries(queries))
+
+    async def aprocess_queries(self, queries: List[str]) -> List[Dict[str, Any]]:
+        """Async process_queries: one batched retrieval of the uncached queries, then concurrent workflows"""
+        try:
+            retrieved = [list(documents) for documents in await asyncio.to_thread(self._retrieve_batch, queries)]
+        except Exception as e:
+            logger.warning(f"Batched retrieval failed, retrieving per query: {e}")
+            retrieved = [None] * len(queries)
+
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_QUERIES)
+
+        async def run(query: str, documents: Optional[List[Document]]) -> Dict[str, Any]:
+            async with semaphore:
+                return await self.aprocess_query(query, documents)
+
+        return await asyncio.gather(*(run(q, docs) for q, docs in zip(queries, retrieved)))
+
+    async def aprocess_query(self, query: str, documents: Optional[List[Document]] = None,
+                             top_k: Optional[int] = None,
+                             confidence_threshold: Optional[float] = None) -> Dict[str, Any]:
+        """Async process_query; LLM round-trips do not block the calling thread.
+
+        documents, if given, are used instead of running a similarity search.
+        """
         try:
             logger.info(f"Processing query: {query}")
 
             # Initialize state
-            initial_state = AgentState(query=query)
+            initial_state = AgentState(
+                query=query,
+                retrieved_documents=documents or [],
+                top_k=top_k or Config.TOP_K_RETRIEVAL,
+                confidence_threshold=confidence_threshold if confidence_threshold is not None else Config.CONFIDENCE_THRESHOLD
+            )
 
             # Run the workflow
-            final_state = self.workflow.invoke(initial_state)
+            final_state = await self.workflow.ainvoke(initial_state)
 
             # If final_state is a dict (LangGraph style)
             if isinstance(final_state, dict):
@@ -306,6 +506,36 @@ Please provide an improved, more accurate, and comprehensive response:"""
                 "workflow_steps": "N/A"
             }
 
+    def stream_query(self, query: str, top_k: Optional[int] = None) -> Dict[str, Any]:
+        """Retrieve context for a query and stream the answer.
+        
+        Runs retrieval and a single generation pass only; the evaluate/improve
+        loop needs the complete response and is skipped. The returned
+        "response_stream" yields text chunks as the LLM produces them.
+        """
+        try:
+            logger.info(f"Streaming query: {query}")
+            documents = _dedupe_documents(list(self._retrieve(query, top_k or Config.TOP_K_RETRIEVAL)))
+            if not documents:
+                raise ValueError("No relevant documents found")
+            
+            context = _format_context(documents)
+            return {
+                "success": True,
+                "query": query,
+                "sources": [doc.metadata.get('source', 'unknown') for doc in documents],
+                "response_stream": self.llm_manager.stream_medical_response(query, context)
+            }
+            
+        except Exception as e:
+            logger.error(f"Error in streaming query: {e}")
+            return {
+                "success": False,
+                "query": query,
+                "error": str(e),
+                "sources": []
+            }
+
     def get_system_status(self) -> Dict[str, Any]:
         """Get current system status and health"""
         try:
@@ -316,8 +546,6 @@ Please provide an improved, more accurate, and comprehensive response:"""
                 "vector_store": vector_stats,
                 "llm_models": llm_models,
                 "config": {
-                    "chunk_size": Config.CHUNK_SIZE,
-                    "chunk_overlap": Config.CHUNK_OVERLAP,
                     "top_k_retrieval": Config.TOP_K_RETRIEVAL,
                     "confidence_threshold": Config.CONFIDENCE_THRESHOLD
                 }
@@ -1,10 +1,25 @@
 import streamlit as st
 import time
 import json
+import os
+import orjson
+from collections import deque
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from system_manager import SystemManager
+from system_manager import SystemManager, scan_pdf_files
 from config import Config
 
+# Minimum seconds between re-renders of a streaming response; redrawing the
+# whole markdown block on every token makes long answers quadratic to render
+STREAM_RENDER_INTERVAL = 0.05
+
+# Number of past queries kept per session
+QUERY_HISTORY_SIZE = 50
+
+# Seconds between reruns while a background task is polled
+BACKGROUND_POLL_INTERVAL = 0.2
+
 # Page configuration
 st.set_page_config(
     page_title="Agentic RAG System",
@@ -14,7 +29,7 @@ st.set_page_config(
 )
 
 # Custom CSS for better styling
-st.markdown("""
+_CSS = """
 <style>
     .main-header {
         font-size: 2.5rem;
@@ -64,42 +79,129 @@ st.markdown("""
         margin: 0.5rem 0;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+@st.cache_data(ttl=60)
+def _scan_pdfs(data_dir, dir_mtime_ns):
+    """Cached PDF scan; dir_mtime_ns only keys the cache so added or removed files show up"""
+    return scan_pdf_files(data_dir)
+
+def scan_pdfs_cached(data_dir):
+    """PDF scan served from the cache while the data directory is unchanged"""
+    dir_mtime_ns = os.stat(data_dir).st_mtime_ns if os.path.isdir(data_dir) else 0
+    return _scan_pdfs(data_dir, dir_mtime_ns)
+
+@st.cache_resource
+def get_system_manager():
+    """One SystemManager shared by all sessions and reruns.
+    
+    cache_resource (not cache_data) because the manager holds unpicklable
+    embedding-model, Chroma and LLM clients that must not be hashed or copied.
+    """
+    return SystemManager(scan_pdfs=scan_pdfs_cached)
+
+class BackgroundTasks:
+    """The slow system task (initialize, rebuild, test) currently running.
+    
+    The SystemManager is shared by every session, so while any session's
+    task runs, all sessions treat the system as busy.
+    """
+    
+    def __init__(self):
+        # Single worker, so slow system tasks never overlap
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-system")
+        self._lock = threading.Lock()
+        self._current = None  # (label, future) of the latest task
+    
+    def submit(self, label, fn):
+        """Start fn unless a task is already running; returns its future, or None if busy"""
+        with self._lock:
+            if self._current is not None and not self._current[1].done():
+                return None
+            future = self._executor.submit(fn)
+            self._current = (label, future)
+            return future
+    
+    def running(self):
+        """Label of the running task, or None when idle"""
+        with self._lock:
+            if self._current is None or self._current[1].done():
+                return None
+            return self._current[0]
+
+@st.cache_resource
+def get_background_tasks():
+    """Background task holder shared by all sessions"""
+    return BackgroundTasks()
+
+def start_background_task(kind, label, fn):
+    """Run a slow SystemManager call off the script thread and rerun to show progress"""
+    future = get_background_tasks().submit(label, fn)
+    if future is not None:
+        st.session_state.background_task = (kind, label, future)
+    st.rerun()
+
+def poll_background_task():
+    """Return (kind, result) once the background task has finished, else None"""
+    task = st.session_state.get('background_task')
+    if not task or not task[2].done():
+        return None
+    del st.session_state.background_task
+    kind, _, future = task
+    try:
+        result = future.result()
+    except Exception as e:
+        result = {"success": False, "error": str(e)}
+    return kind, result
 
 def main():
+    # Streamlit only keeps elements emitted during the current run, so the
+    # stylesheet has to be sent on every rerun rather than once per session
+    st.markdown(_CSS, unsafe_allow_html=True)
+    
     # Main header
     st.markdown('<h1 class="main-header">🧠 Agentic RAG System</h1>', unsafe_allow_html=True)
     st.markdown("### Medical Document Analysis with LangGraph & Autonomous AI")
     
     # Initialize session state
     if 'system_manager' not in st.session_state:
-        st.session_state.system_manager = SystemManager()
-        st.session_state.system_initialized = False
-        st.session_state.query_history = []
+        st.session_state.system_manager = get_system_manager()
+        st.session_state.query_history = deque(maxlen=QUERY_HISTORY_SIZE)
+    finished = poll_background_task()
+    # Tasks of every session count: they all use the same SystemManager
+    running_task = get_background_tasks().running()
+    busy = running_task is not None
+    # The manager is shared, so another session may already have initialized it
+    st.session_state.system_initialized = st.session_state.system_manager.is_initialized
     
     # Sidebar
     with st.sidebar:
         st.markdown("## 🔧 System Control")
         
         # System initialization
-        if st.button("🚀 Initialize System", type="primary"):
-            with st.spinner("Initializing RAG system..."):
-                result = st.session_state.system_manager.initialize_system()
-                if result["success"]:
-                    st.session_state.system_initialized = True
-                    st.success("System initialized successfully!")
-                else:
-                    st.error(f"Initialization failed: {result.get('error', 'Unknown error')}")
+        if st.button("🚀 Initialize System", type="primary", disabled=busy or st.session_state.system_initialized):
+            start_background_task("init", "Initializing RAG system...", st.session_state.system_manager.initialize_system)
         
         # Force rebuild option
         if st.checkbox("Force Rebuild Vector Store"):
-            if st.button("🔄 Rebuild System"):
-                with st.spinner("Rebuilding vector store..."):
-                    result = st.session_state.system_manager.rebuild_vector_store()
-                    if result["success"]:
-                        st.success("Vector store rebuilt successfully!")
-                    else:
-                        st.error(f"Rebuild failed: {result.get('error', 'Unknown error')}")
+            if st.button("🔄 Rebuild System", disabled=busy):
+                start_background_task("rebuild", "Rebuilding vector store...", st.session_state.system_manager.rebuild_vector_store)
+        
+        if busy:
+            st.info(f"⏳ {running_task}")
+        if finished and finished[0] == "init":
+            result = finished[1]
+            if result["success"]:
+                st.success("System initialized successfully!")
+            else:
+                st.error(f"Initialization failed: {result.get('error', 'Unknown error')}")
+        elif finished and finished[0] == "rebuild":
+            result = finished[1]
+            _scan_pdfs.clear()
+            if result["success"]:
+                st.success("Vector store rebuilt successfully!")
+            else:
+                st.error(f"Rebuild failed: {result.get('error', 'Unknown error')}")
         
         # System status
         st.markdown("## 📊 System Status")
@@ -110,8 +212,9 @@ def main():
         
         # Configuration info
         st.markdown("## ⚙️ Configuration")
-        st.info(f"**Chunk Size:** {Config.CHUNK_SIZE}")
-        st.info(f"**Chunk Overlap:** {Config.CHUNK_OVERLAP}")
+        processor = st.session_state.system_manager.document_processor
+        st.info(f"**Chunk Size:** {processor.chunk_size} {processor.chunk_unit}")
+        st.info(f"**Chunk Overlap:** {processor.chunk_overlap} {processor.chunk_unit}")
         st.info(f"**Top-K Retrieval:** {Config.TOP_K_RETRIEVAL}")
         st.info(f"**Confidence Threshold:** {Config.CONFIDENCE_THRESHOLD}")
     
@@ -124,6 +227,7 @@ def main():
         # Query input
         query = st.text_area(
             "Enter your medical query:",
+            key="query_input",
             height=100,
             placeholder="e.g., What are the findings of the critical-care pain observation tool study?"
         )
@@ -147,16 +251,26 @@ def main():
                 value=Config.TOP_K_RETRIEVAL
             )
         
+        stream = st.checkbox("Stream response", help="Show the answer as it is generated (skips the evaluate/improve loop)")
+        
         # Process query button
-        if st.button("🔍 Process Query", type="primary", disabled=not st.session_state.system_initialized):
-            if query.strip():
-                process_query(query, confidence_threshold, top_k)
+        if st.button("🔍 Process Query", type="primary", disabled=busy or not st.session_state.system_initialized):
+            if get_background_tasks().running():
+                # Another session started a task after this page was drawn
+                st.warning("The system is busy, please try again when it finishes.")
+            elif query.strip():
+                if stream:
+                    stream_query(query, top_k)
+                else:
+                    process_query(query, confidence_threshold, top_k)
             else:
                 st.warning("Please enter a query first.")
         
         # Display results
         if 'current_result' in st.session_state and st.session_state.current_result:
             display_query_result(st.session_state.current_result)
+        
+        show_query_history()
     
     with col2:
         st.markdown('<h2 class="sub-header">📚 Sample Queries</h2>', unsafe_allow_html=True)
@@ -168,22 +282,35 @@ def main():
             "Findest du, dass Künstliche Intelligenz in Zukunft Ärztinnen und Ärzte bei der Diagnose von seltenen Krankheiten besser unterstützen kann?"
         ]
         
-        for i, sample_query in enumerate(sample_queries):
-            if st.button(f"Query {i+1}", key=f"sample_{i}"):
-                st.session_state.query_input = sample_query
-                st.rerun()
+        # Form buttons with callbacks fill the query box before the rerun
+        # renders it, so a click costs exactly one rerun
+        with st.form("sample_queries", border=False):
+            for i, sample_query in enumerate(sample_queries):
+                st.form_submit_button(f"Query {i+1}", on_click=use_sample_query, args=(sample_query,))
         
         # Quick actions
         st.markdown('<h3 class="sub-header">⚡ Quick Actions</h3>', unsafe_allow_html=True)
         
-        if st.button("🧪 Test System"):
-            test_system()
+        if st.button("🧪 Test System", disabled=busy):
+            start_background_task("test", "Running system test...", st.session_state.system_manager.test_system)
+        
+        if finished and finished[0] == "test":
+            show_test_result(finished[1])
         
         if st.button("📊 System Status"):
             show_system_status()
         
         if st.button("📁 Document Info"):
             show_document_info()
+    
+    # Keep polling until the running task finishes and this session has shown its own result
+    if busy or 'background_task' in st.session_state:
+        time.sleep(BACKGROUND_POLL_INTERVAL)
+        st.rerun()
+
+def use_sample_query(sample_query):
+    """Put a sample query into the query box"""
+    st.session_state.query_input = sample_query
 
 def process_query(query, confidence_threshold, top_k):
     """Process a user query and display results"""
@@ -191,22 +318,16 @@ def process_query(query, confidence_threshold, top_k):
     st.markdown(f"### 🔍 Processing Query: {query}")
     
     with st.spinner("Processing query through RAG system..."):
-        # Update configuration temporarily
-        Config.CONFIDENCE_THRESHOLD = confidence_threshold
-        Config.TOP_K_RETRIEVAL = top_k
-        
-        # Process query
-        result = st.session_state.system_manager.process_query(query)
+        # Process query with this session's retrieval settings
+        result = st.session_state.system_manager.process_query(
+            query, top_k=top_k, confidence_threshold=confidence_threshold
+        )
         
         # Store result in session state
         st.session_state.current_result = result
         
         # Add to query history
-        st.session_state.query_history.append({
-            "query": query,
-            "result": result,
-            "timestamp": time.time()
-        })
+        record_query(query, result)
         
         # Display immediate feedback
         if result["success"]:
@@ -214,6 +335,72 @@ def process_query(query, confidence_threshold, top_k):
         else:
             st.error(f"❌ Query processing failed: {result.get('error', 'Unknown error')}")
 
+def stream_query(query, top_k):
+    """Process a user query, rendering the response while it streams in"""
+    st.markdown("---")
+    st.markdown(f"### 🔍 Processing Query: {query}")
+    
+    with st.spinner("Retrieving documents..."):
+        result = st.session_state.system_manager.stream_query(query, top_k=top_k)
+    
+    if result["success"]:
+        placeholder = st.empty()
+        buffer = ""
+        last_flush = time.monotonic()
+        try:
+            for token in result.pop("response_stream"):
+                buffer += token
+                if time.monotonic() - last_flush > STREAM_RENDER_INTERVAL:
+                    placeholder.markdown(buffer)
+                    last_flush = time.monotonic()
+            result["response"] = buffer
+        except Exception as e:
+            result.update(success=False, error=str(e))
+        # The complete answer is rendered by display_query_result
+        placeholder.empty()
+    
+    result.setdefault("workflow_steps", "generate")
+    st.session_state.current_result = result
+    record_query(query, result)
+    
+    if result["success"]:
+        st.success("✅ Query processed successfully!")
+    else:
+        st.error(f"❌ Query processing failed: {result.get('error', 'Unknown error')}")
+
+def record_query(query, result):
+    """Append an entry to the session's bounded query history.
+    
+    The result is kept as orjson bytes: session state is copied on reruns,
+    and one bytes object is far cheaper to copy than the nested result dict.
+    """
+    st.session_state.query_history.append({
+        "query": query,
+        "confidence": result.get("confidence"),
+        "blob": orjson.dumps(result, default=str),
+        "timestamp": time.time()
+    })
+
+def restore_history_entry():
+    """Show the selected history entry as the current result"""
+    entry = st.session_state.history_choice
+    st.session_state.current_result = orjson.loads(entry["blob"])
+
+def show_query_history():
+    """Let the user reopen one of this session's previous results"""
+    if not st.session_state.query_history:
+        return
+    
+    st.markdown("#### 🕘 Query History")
+    st.selectbox(
+        "Previous queries",
+        list(reversed(st.session_state.query_history)),
+        format_func=lambda entry: f"{entry['query'][:80]} ({entry['confidence'] or 0:.2f})",
+        key="history_choice"
+    )
+    # Only the selected entry is decoded, and only when requested
+    st.button("Show Result", key="history_show", on_click=restore_history_entry)
+
 def display_query_result(result):
     """Display the results of a processed query"""
     st.markdown("---")
@@ -258,19 +445,24 @@ def display_query_result(result):
                 st.markdown(value)
                 st.markdown("---")
 
-def test_system():
-    """Run a system test"""
+def _fast_json(obj):
+    """Indented JSON text for st.code; cheaper to render than the st.json tree widget"""
+    return orjson.dumps(
+        obj,
+        option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+        default=str
+    ).decode()
+
+def show_test_result(result):
+    """Display the result of a system test"""
     st.markdown("---")
     st.markdown("### 🧪 System Test")
     
-    with st.spinner("Running system test..."):
-        result = st.session_state.system_manager.test_system()
-        
-        if "error" in result:
-            st.error(f"Test failed: {result['error']}")
-        else:
-            st.success("✅ System test completed!")
-            st.json(result)
+    if "error" in result:
+        st.error(f"Test failed: {result['error']}")
+    else:
+        st.success("✅ System test completed!")
+        st.code(_fast_json(result), language="json")
 
 def show_system_status():
     """Display comprehensive system status"""
@@ -278,12 +470,12 @@ def show_system_status():
     st.markdown("### 📊 System Status")
     
     with st.spinner("Gathering system information..."):
-        status = st.session_state.system_manager.get_system_status()
+        status = st.session_state.system_manager.get_system_status(lightweight=False)
         
         if "error" in status:
             st.error(f"Error getting status: {status['error']}")
         else:
-            st.json(status)
+            st.code(_fast_json(status), language="json")
 
 def show_document_info():
     """Display information about processed documents"""
@@ -296,12 +488,7 @@ def show_document_info():
         if "error" in doc_info:
             st.error(f"Error getting document info: {doc_info['error']}")
         else:
-            st.json(doc_info)
-
-# Check if query input was set from sample queries
-if 'query_input' in st.session_state:
-    st.session_state.query_input = ""
-    st.rerun()
+            st.code(_fast_json(doc_info), language="json")
 
 if __name__ == "__main__":
     main()
@@ -1,19 +1,45 @@
 import os
 import logging
-from typing import Dict, Any, List
-from pathlib import Path
+from typing import Dict, Any, List, Callable, Optional
 from config import Config
-from document_processor import DocumentProcessor
-from vector_store import VectorStore
-from rag_agent import RAGAgent
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def scan_pdf_files(data_dir: str) -> List[Dict[str, Any]]:
+    """Name, size and modification time of each PDF in data_dir, from one scandir pass"""
+    if not os.path.isdir(data_dir):
+        return []
+    
+    document_info = []
+    with os.scandir(data_dir) as it:
+        for entry in it:
+            if not entry.name.endswith(".pdf"):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except OSError:
+                # Deleted or replaced since the directory was read
+                continue
+            document_info.append({
+                "filename": entry.name,
+                "size_mb": round(stat.st_size / (1024 * 1024), 2),
+                "last_modified": stat.st_mtime
+            })
+    return document_info
+
 class SystemManager:
     """Manages the complete RAG system initialization and coordination"""
     
-    def __init__(self):
+    def __init__(self, scan_pdfs: Callable[[str], List[Dict[str, Any]]] = scan_pdf_files):
+        # Directory scan used by get_document_info; callers may pass a cached one
+        self.scan_pdfs = scan_pdfs
+        # Imported here so that importing this module does not pull in
+        # langchain, chromadb and torch
+        from document_processor import DocumentProcessor
+        from vector_store import VectorStore
         self.document_processor = DocumentProcessor()
         self.vector_store = VectorStore()
         self.rag_agent = None
@@ -22,6 +48,14 @@ class SystemManager:
         
     def initialize_system(self, force_rebuild: bool = False) -> Dict[str, Any]:
         """Initialize the complete RAG system"""
+        if self.is_initialized and not force_rebuild:
+            return {
+                "success": True,
+                "message": "Already initialized",
+                "documents_processed": self.documents_processed,
+                "vector_store_loaded": True
+            }
+        
         try:
             logger.info("Initializing RAG system...")
             
@@ -43,8 +77,12 @@ class SystemManager:
                 
                 self.documents_processed = True
             
-            # Initialize RAG agent
-            self.rag_agent = RAGAgent()
+            # Initialize RAG agent on the vector store loaded above
+            if self.rag_agent is None:
+                from rag_agent import RAGAgent
+                self.rag_agent = RAGAgent(self.vector_store)
+            else:
+                self.rag_agent.refresh_retriever(self.vector_store)
             
             self.is_initialized = True
             logger.info("RAG system initialization completed successfully")
@@ -69,36 +107,31 @@ class SystemManager:
         try:
             logger.info("Processing PDF documents...")
             
-            # Process all PDF documents
-            documents = self.document_processor.process_pdf_documents()
+            # Extract and chunk PDFs one at a time so full document texts
+            # are released as soon as they have been split
+            chunked_docs = list(self.document_processor.iter_chunks())
             
-            if not documents:
-                logger.error("No documents found to process")
+            if not chunked_docs:
+                logger.error("No document chunks produced from the data directory")
                 return False
             
             # Get document summary
-            summary = self.document_processor.get_document_summary(documents)
+            summary = self.document_processor.get_document_summary(chunked_docs)
             logger.info(f"Document processing summary: {summary}")
             
-            # Chunk documents
-            chunked_docs = self.document_processor.chunk_documents(documents)
-            
-            if not chunked_docs:
-                logger.error("Document chunking failed")
-                return False
-            
             # Create vector store
             self.vector_store.create_vector_store(chunked_docs)
             
-            logger.info(f"Successfully processed {len(documents)} documents into {len(chunked_docs)} chunks")
+            logger.info(f"Successfully processed {summary['total_documents']} documents into {len(chunked_docs)} chunks")
             return True
             
         except Exception as e:
             logger.error(f"Document processing failed: {e}")
             return False
     
-    def process_query(self, query: str) -> Dict[str, Any]:
-        """Process a user query through the RAG system"""
+    def process_query(self, query: str, top_k: Optional[int] = None,
+                      confidence_threshold: Optional[float] = None) -> Dict[str, Any]:
+        """Process a user query through the RAG system, optionally overriding retrieval settings"""
         if not self.is_initialized:
             return {
                 "success": False,
@@ -108,7 +141,7 @@ class SystemManager:
         
         try:
             logger.info(f"Processing query: {query}")
-            result = self.rag_agent.process_query(query)
+            result = self.rag_agent.process_query(query, top_k=top_k, confidence_threshold=confidence_threshold)
             return result
             
         except Exception as e:
@@ -120,8 +153,47 @@ class SystemManager:
                 "message": "Query processing failed"
             }
     
-    def get_system_status(self) -> Dict[str, Any]:
-        """Get comprehensive system status"""
+    def stream_query(self, query: str, top_k: Optional[int] = None) -> Dict[str, Any]:
+        """Process a user query, streaming the response text as it is generated"""
+        if not self.is_initialized:
+            return {
+                "success": False,
+                "error": "System not initialized",
+                "message": "Please initialize the system first"
+            }
+        
+        logger.info(f"Streaming query: {query}")
+        return self.rag_agent.stream_query(query, top_k=top_k)
+    
+    def process_queries(self, queries: List[str]) -> List[Dict[str, Any]]:
+        """Process several user queries concurrently through the RAG system"""
+        if not self.is_initialized:
+            return [{
+                "success": False,
+                "query": query,
+                "error": "System not initialized",
+                "message": "Please initialize the system first"
+            } for query in queries]
+        
+        try:
+            logger.info(f"Processing {len(queries)} queries")
+            return self.rag_agent.process_queries(queries)
+            
+        except Exception as e:
+            logger.error(f"Batch query processing failed: {e}")
+            return [{
+                "success": False,
+                "query": query,
+                "error": str(e),
+                "message": "Query processing failed"
+            } for query in queries]
+    
+    def get_system_status(self, lightweight: bool = True) -> Dict[str, Any]:
+        """Get system status.
+        
+        lightweight returns only local flags and config; pass False to include
+        the vector store and LLM details gathered by the RAG agent.
+        """
         try:
             status = {
                 "system_initialized": self.is_initialized,
@@ -129,15 +201,18 @@ class SystemManager:
                 "config": {
                     "data_directory": Config.DATA_DIR,
                     "vector_store_directory": Config.VECTOR_STORE_DIR,
-                    "chunk_size": Config.CHUNK_SIZE,
-                    "chunk_overlap": Config.CHUNK_OVERLAP,
+                    "chunk_size": self.document_processor.chunk_size,
+                    "chunk_overlap": self.document_processor.chunk_overlap,
+                    "chunk_unit": self.document_processor.chunk_unit,
                     "top_k_retrieval": Config.TOP_K_RETRIEVAL,
                     "confidence_threshold": Config.CONFIDENCE_THRESHOLD
                 }
             }
             
-            if self.is_initialized and self.rag_agent:
+            if not lightweight and self.is_initialized and self.rag_agent:
                 agent_status = self.rag_agent.get_system_status()
+                # The config above includes the effective chunking, which the agent doesn't know
+                agent_status.pop("config", None)
                 status.update(agent_status)
             
             return status
@@ -159,8 +234,12 @@ class SystemManager:
             success = self._process_documents()
             
             if success:
-                # Reinitialize RAG agent
-                self.rag_agent = RAGAgent()
+                # Swap the rebuilt store into the agent; LLM clients are kept
+                if self.rag_agent is None:
+                    from rag_agent import RAGAgent
+                    self.rag_agent = RAGAgent(self.vector_store)
+                else:
+                    self.rag_agent.refresh_retriever(self.vector_store)
                 logger.info("Vector store rebuilt successfully")
                 
                 return {
@@ -190,23 +269,10 @@ class SystemManager:
             vector_stats = self.vector_store.get_collection_stats()
             
             # Get document files info
-            data_dir = Path(Config.DATA_DIR)
-            pdf_files = list(data_dir.glob("*.pdf"))
-            
-            document_info = []
-            for pdf_file in pdf_files:
-                try:
-                    stat = pdf_file.stat()
-                    document_info.append({
-                        "filename": pdf_file.name,
-                        "size_mb": round(stat.st_size / (1024 * 1024), 2),
-                        "last_modified": stat.st_mtime
-                    })
-                except Exception as e:
-                    logger.warning(f"Error getting info for {pdf_file}: {e}")
+            document_info = self.scan_pdfs(Config.DATA_DIR)
             
             return {
-                "total_pdf_files": len(pdf_files),
+                "total_pdf_files": len(document_info),
                 "documents": document_info,
                 "vector_store": vector_stats
             }
@@ -6,53 +6,57 @@ This script tests the core functionality without requiring API keys
 
 import os
 import sys
+import importlib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-def test_imports():
-    """Test that all required modules can be imported"""
-    print("Testing module imports...")
-    
-    try:
-        from config import Config
-        print("✅ Config module imported successfully")
-    except ImportError as e:
-        print(f"❌ Config import failed: {e}")
-        return False
-    
-    try:
-        from document_processor import DocumentProcessor
-        print("✅ DocumentProcessor module imported successfully")
-    except ImportError as e:
-        print(f"❌ DocumentProcessor import failed: {e}")
-        return False
-    
+# Project modules checked by test_imports, with a name each one must define
+PROJECT_MODULES = [
+    ("config", "Config"),
+    ("pdf_extraction", "extract_pages"),
+    ("document_processor", "DocumentProcessor"),
+    ("embeddings", "get_embeddings"),
+    ("vector_store", "VectorStore"),
+    ("llm_manager", "LLMManager"),
+    ("rag_agent", "RAGAgent"),
+    ("system_manager", "SystemManager"),
+]
+
+def _try_import(module_name):
+    """Import a module, returning the ImportError instead of raising it"""
     try:
-        from vector_store import VectorStore
-        print("✅ VectorStore module imported successfully")
+        importlib.import_module(module_name)
+        return None
     except ImportError as e:
-        print(f"❌ VectorStore import failed: {e}")
-        return False
+        return e
+
+def test_imports():
+    """Test that all required modules can be imported.
     
-    try:
-        from llm_manager import LLMManager
-        print("✅ LLMManager module imported successfully")
-    except ImportError as e:
-        print(f"❌ LLMManager import failed: {e}")
-        return False
+    All modules are imported by one compiled statement; only if that fails
+    are they imported one by one to find the failing module. Those imports
+    run on a thread pool: the import lock serializes module execution, but
+    the file-system and shared-library loading of the heavy dependencies
+    overlaps.
+    """
+    print("Testing module imports...")
     
+    module_names = [module_name for module_name, _ in PROJECT_MODULES]
     try:
-        from rag_agent import RAGAgent
-        print("✅ RAGAgent module imported successfully")
-    except ImportError as e:
-        print(f"❌ RAGAgent import failed: {e}")
-        return False
+        exec(compile("import " + ", ".join(module_names), "<test_imports>", "exec"), {})
+        errors = [None if name in sys.modules else ImportError(f"{name} not loaded") for name in module_names]
+    except ImportError:
+        with ThreadPoolExecutor(max_workers=len(module_names)) as executor:
+            errors = list(executor.map(_try_import, module_names))
     
-    try:
-        from system_manager import SystemManager
-        print("✅ SystemManager module imported successfully")
-    except ImportError as e:
-        print(f"❌ SystemManager import failed: {e}")
-        return False
+    for (module_name, attribute), error in zip(PROJECT_MODULES, errors):
+        if error is None and not hasattr(sys.modules[module_name], attribute):
+            error = ImportError(f"{module_name} does not define {attribute}")
+        if error is None:
+            print(f"✅ {module_name} module imported successfully")
+        else:
+            print(f"❌ {module_name} import failed: {error}")
+            return False
     
     return True
 
@@ -129,6 +133,85 @@ def test_vector_store():
         print(f"❌ Vector store test failed: {e}")
         return False
 
+def test_index_parity():
+    """Test that the numpy index returns the same results as FAISS exact search"""
+    print("\nTesting index parity...")
+    
+    try:
+        import numpy as np
+        import faiss
+        from vector_store import NumpyIndex
+        
+        rng = np.random.default_rng(0)
+        vectors = rng.standard_normal((500, 64)).astype(np.float32)
+        queries = rng.standard_normal((5, 64)).astype(np.float32)
+        faiss.normalize_L2(vectors)
+        faiss.normalize_L2(queries)
+        
+        numpy_index = NumpyIndex(64)
+        numpy_index.add(vectors)
+        flat_index = faiss.IndexFlatIP(64)
+        flat_index.add(vectors)
+        
+        numpy_scores, numpy_rows = numpy_index.search(queries, 10)
+        flat_scores, flat_rows = flat_index.search(queries, 10)
+        if not np.array_equal(numpy_rows, flat_rows) or not np.allclose(numpy_scores, flat_scores, atol=1e-5):
+            print("❌ NumpyIndex results differ from IndexFlatIP")
+            return False
+        print("✅ NumpyIndex matches IndexFlatIP top-10 rows and scores")
+        
+        return True
+        
+    except Exception as e:
+        print(f"❌ Index parity test failed: {e}")
+        return False
+
+class _CountingStore:
+    """Stand-in vector store for test_retrieval_cache that counts searches"""
+    
+    def __init__(self):
+        self.generation = 0
+        self.searches = 0
+    
+    def similarity_search(self, query, k=None):
+        from langchain.schema import Document
+        self.searches += 1
+        return [Document(page_content=query)]
+    
+    def similarity_search_batch(self, queries, k=None):
+        return [self.similarity_search(query, k) for query in queries]
+
+def test_retrieval_cache():
+    """Test that retrievals are cached and invalidated when the store changes"""
+    print("\nTesting retrieval cache...")
+    
+    try:
+        from rag_agent import RAGAgent
+        
+        store = _CountingStore()
+        agent = RAGAgent(store)
+        
+        agent._retrieve("fever", 3)
+        agent._retrieve_batch(["fever", "cough", "cough"], 3)
+        if store.searches != 2:
+            print(f"❌ Expected 2 searches for 2 distinct queries, got {store.searches}")
+            return False
+        print("✅ Cached and repeated queries are not searched again")
+        
+        # add_documents bumps the store's generation
+        store.generation += 1
+        agent._retrieve("fever", 3)
+        if store.searches != 3:
+            print("❌ Cached result served after the store changed")
+            return False
+        print("✅ Changing the store invalidates cached retrievals")
+        
+        return True
+        
+    except Exception as e:
+        print(f"❌ Retrieval cache test failed: {e}")
+        return False
+
 def test_llm_manager():
     """Test LLM manager functionality"""
     print("\nTesting LLM manager...")
@@ -176,7 +259,9 @@ def test_file_structure():
     required_files = [
         "requirements.txt",
         "config.py",
+        "pdf_extraction.py",
         "document_processor.py",
+        "embeddings.py",
         "vector_store.py",
         "llm_manager.py",
         "rag_agent.py",
@@ -211,6 +296,8 @@ def main():
         ("Configuration", test_configuration),
         ("Document Processing", test_document_processing),
         ("Vector Store", test_vector_store),
+        ("Index Parity", test_index_parity),
+        ("Retrieval Cache", test_retrieval_cache),
         ("LLM Manager", test_llm_manager),
         ("System Manager", test_system_manager)
     ]
@@ -1,28 +1,140 @@
 import os
+import json
+import uuid
+import hashlib
 import logging
-from typing import List, Dict, Any, Optional
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple, Sequence, Union
 from pathlib import Path
+import faiss
+import numpy as np
 import chromadb
 from chromadb.config import Settings
-from sentence_transformers import SentenceTransformer
 from langchain.schema import Document
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_chroma import Chroma
 from config import Config
+from embeddings import get_embeddings, EMBEDDING_BACKEND
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# HNSW graph parameters of the in-memory FAISS index searched instead of
+# Chroma's brute-force scan; Chroma remains the persistent document store.
+# HNSW is the default index type.
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 100
+HNSW_EF_SEARCH = 64
+
+# IVF-PQ parameters: vectors are split into IVF_PQ_M sub-vectors of
+# IVF_PQ_NBITS-bit codes (16x smaller than float32 for 384-d embeddings),
+# and at most IVF_MAX_NPROBE inverted lists are scanned per query
+IVF_PQ_M = 8
+IVF_PQ_NBITS = 8
+IVF_MAX_NPROBE = 10
+# PQ training needs at least 2**nbits vectors; smaller corpora use HNSW
+IVF_MIN_TRAINING_VECTORS = 2 ** IVF_PQ_NBITS
+
+# "flat" is exact search: an inner-product scan over unit-length vectors
+# (cosine similarity) run by FAISS's SIMD kernels; suited to small corpora.
+# "numpy" is the same exact search as one BLAS matrix-vector product over a
+# contiguous (N, d) array, without FAISS. "sq8" is exact inner-product search
+# over 8-bit scalar-quantized vectors, a quarter of the float32 memory.
+INDEX_TYPES = ("hnsw", "ivfpq", "flat", "numpy", "sq8")
+
+# Index type used when VectorStore is created without one
+INDEX_TYPE = os.getenv("INDEX_TYPE", "hnsw")
+
+# Number of query embeddings memoized per VectorStore
+QUERY_EMBEDDING_CACHE_SIZE = 4096
+
+# Backends whose embed_query encodes exactly like embed_documents, so
+# uncached queries can be embedded in one embed_documents batch. Backends
+# with a query-specific batch API provide embed_queries instead; any other
+# backend embeds queries one at a time.
+SYMMETRIC_QUERY_BACKENDS = ("huggingface", "onnx", "tei")
+
+# Texts per embedding batch when building the store; texts are sorted by
+# length first so each batch pads to similar lengths
+EMBED_BATCH_SIZE = 64
+
+# Batches embedded concurrently for backends that only wait on a server.
+# Local models embed one batch at a time: each forward pass already uses
+# every core, so concurrent batches would oversubscribe the CPU.
+EMBED_WORKERS = 4
+IO_BOUND_EMBEDDING_BACKENDS = ("tei",)
+
+# Chunk embeddings from earlier builds, keyed by a hash of the chunk text,
+# so rebuilding over unchanged documents skips tokenization and inference
+EMBEDDING_CACHE_DIR = os.path.join(".cache", "embeddings")
+# Incremental writes add one shard each; past this many the cache is merged
+# back into a single shard so loading it stays cheap
+EMBEDDING_CACHE_MAX_SHARDS = 16
+
+# Index files written next to the Chroma database, per index type
+INDEX_FILE = "faiss_{}.index"
+INDEX_IDS_FILE = "faiss_{}_ids.json"
+
+def _ids_stamp(ids: Sequence[str]) -> str:
+    """Hash identifying a set of Chroma record ids, independent of their order"""
+    digest = hashlib.blake2b(digest_size=16)
+    for doc_id in sorted(ids):
+        digest.update(doc_id.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+class NumpyIndex:
+    """Exact inner-product search over a contiguous (N, d) float32 array.
+    
+    Implements the part of the FAISS index interface VectorStore uses.
+    """
+    metric_type = faiss.METRIC_INNER_PRODUCT
+    
+    def __init__(self, dim: int):
+        self.d = dim
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+    
+    @property
+    def ntotal(self) -> int:
+        """Number of stored vectors"""
+        return len(self.vectors)
+    
+    def add(self, vectors: np.ndarray) -> None:
+        """Append rows to the stored array"""
+        self.vectors = np.ascontiguousarray(np.vstack([self.vectors, vectors]), dtype=np.float32)
+    
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k (scores, rows) per query, best first"""
+        scores = queries @ self.vectors.T
+        # Partition out the k best in one linear pass, then sort only those
+        k = min(k, scores.shape[1])
+        rows = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, rows, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        return np.take_along_axis(top_scores, order, axis=1), np.take_along_axis(rows, order, axis=1)
+
 class VectorStore:
     """Manages vector storage and similarity search for documents"""
     
-    def __init__(self):
-        self.embedding_model = HuggingFaceEmbeddings(
-            model_name=Config.EMBEDDING_MODEL,
-            model_kwargs={'device': 'cpu'}
-        )
+    def __init__(self, index_type: str = INDEX_TYPE, embedding_backend: str = EMBEDDING_BACKEND):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type {index_type!r}, expected one of {INDEX_TYPES}")
+        self.index_type = index_type
+        self.embedding_backend = embedding_backend
+        self.embedding_model = get_embeddings(embedding_backend)
+        # LRU of query -> embedding shared by all search methods, so repeated
+        # queries (follow-ups, retries) skip the transformer forward pass
+        self._query_vectors = OrderedDict()
+        self._query_vectors_lock = threading.Lock()
         self.vector_store = None
         self.collection_name = "medical_documents"
+        # FAISS index over the collection's embeddings, and the Chroma id of each row
+        self.index = None
+        self.index_ids = []
+        self._embedding_dim = None
+        # Bumped whenever the stored documents change, so callers can key caches on it
+        self.generation = 0
         
         # Ensure vector store directory exists
         os.makedirs(Config.VECTOR_STORE_DIR, exist_ok=True)
@@ -33,15 +145,21 @@ class VectorStore:
             logger.info("Creating vector store with document embeddings")
             
             # Create Chroma vector store
-            self.vector_store = Chroma.from_documents(
-                documents=documents,
-                embedding=self.embedding_model,
+            self.vector_store = Chroma(
                 persist_directory=Config.VECTOR_STORE_DIR,
+                embedding_function=self.embedding_model,
                 collection_name=self.collection_name
             )
             
-            # Persist the vector store
-            self.vector_store.persist()
+            # Embed every chunk exactly once and hand the vectors to both
+            # Chroma and the FAISS index
+            texts = [doc.page_content for doc in documents]
+            vectors = self._embed_texts(texts, prune_cache=True)
+            ids = [str(uuid.uuid4()) for _ in documents]
+            self._add_to_collection(ids, vectors, texts, [doc.metadata for doc in documents])
+            
+            self._build_index(ids, vectors)
+            self.generation += 1
             logger.info(f"Vector store created with {len(documents)} documents")
             
         except Exception as e:
@@ -49,35 +167,382 @@ class VectorStore:
             raise
     
     def load_existing_vector_store(self) -> bool:
-        """Load existing vector store if available"""
+        """Load existing vector store if available; a no-op when already loaded"""
+        if self.vector_store is not None:
+            return True
+        
         try:
-            if os.path.exists(Config.VECTOR_STORE_DIR):
-                # Check if the directory has actual data
-                if os.path.exists(os.path.join(Config.VECTOR_STORE_DIR, "chroma.sqlite3")):
-                    self.vector_store = Chroma(
-                        persist_directory=Config.VECTOR_STORE_DIR,
-                        embedding_function=self.embedding_model,
-                        collection_name=self.collection_name
-                    )
-                    # Verify the vector store is working
-                    try:
-                        # Test if we can access the collection
-                        _ = self.vector_store._collection.count()
-                        logger.info("Loaded existing vector store successfully")
-                        return True
-                    except Exception as e:
-                        logger.warning(f"Vector store loaded but collection access failed: {e}")
-                        self.vector_store = None
-                        return False
-                else:
-                    logger.info("Vector store directory exists but no data found")
+            # One stat on the database file covers a missing directory as well
+            if (Path(Config.VECTOR_STORE_DIR) / "chroma.sqlite3").is_file():
+                self.vector_store = Chroma(
+                    persist_directory=Config.VECTOR_STORE_DIR,
+                    embedding_function=self.embedding_model,
+                    collection_name=self.collection_name
+                )
+                # Verify the vector store is working
+                try:
+                    # Test if we can access the collection
+                    _ = self.vector_store._collection.count()
+                    self._ensure_index()
+                    logger.info("Loaded existing vector store successfully")
+                    return True
+                except Exception as e:
+                    logger.warning(f"Vector store loaded but collection access failed: {e}")
+                    self.vector_store = None
                     return False
-            return False
+            else:
+                logger.info("No existing vector store data found")
+                return False
         except Exception as e:
             logger.error(f"Error loading existing vector store: {e}")
             self.vector_store = None
             return False
     
+    def _embedding_cache_dir(self) -> str:
+        """On-disk chunk embedding cache for the current model and backend"""
+        model = Config.EMBEDDING_MODEL.replace("/", "__")
+        return os.path.join(EMBEDDING_CACHE_DIR, f"{model}-{self.embedding_backend}")
+    
+    def _embedding_cache_shards(self) -> List[str]:
+        """Files of the embedding cache; each holds the entries of one write"""
+        cache_dir = self._embedding_cache_dir()
+        if not os.path.isdir(cache_dir):
+            return []
+        return [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith(".npz")]
+    
+    def _load_embedding_cache(self) -> Dict[str, np.ndarray]:
+        """Cached embeddings by chunk-text hash; unreadable shards are skipped"""
+        cache = {}
+        for path in self._embedding_cache_shards():
+            try:
+                with np.load(path) as data:
+                    cache.update(zip(data["keys"].tolist(), data["vectors"]))
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable embedding cache {path}: {e}")
+        return cache
+    
+    def _write_embedding_shard(self, entries: Dict[str, np.ndarray]) -> Optional[str]:
+        """Write entries as a new cache shard atomically; failures only cost the next rebuild"""
+        cache_dir = self._embedding_cache_dir()
+        path = os.path.join(cache_dir, f"{uuid.uuid4().hex}.npz")
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(f, keys=np.array(list(entries)), vectors=np.array(list(entries.values()), dtype=np.float32))
+            os.replace(tmp_path, path)
+            return path
+        except Exception as e:
+            logger.warning(f"Could not write embedding cache {path}: {e}")
+            return None
+    
+    def _replace_embedding_cache(self, entries: Dict[str, np.ndarray]) -> None:
+        """Rewrite the cache as a single shard holding only entries"""
+        old_shards = self._embedding_cache_shards()
+        if self._write_embedding_shard(entries) is None:
+            return
+        for path in old_shards:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    
+    def _embed_texts(self, texts: List[str], prune_cache: bool = False) -> np.ndarray:
+        """Embed texts, reusing embeddings of identical chunks from earlier builds.
+        
+        New embeddings are appended to the cache as one shard. prune_cache,
+        for full rebuilds, instead rewrites the cache with only these texts,
+        dropping entries of deleted or changed chunks.
+        """
+        keys = [hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest() for text in texts]
+        cache = self._load_embedding_cache()
+        missing = [i for i, key in enumerate(keys) if key not in cache]
+        new_entries = {}
+        if missing:
+            logger.info(f"Embedding {len(missing)} of {len(texts)} chunks ({len(texts) - len(missing)} cached)")
+            new_vectors = self._embed_uncached([texts[i] for i in missing])
+            for i, vector in zip(missing, new_vectors):
+                new_entries[keys[i]] = vector
+            cache.update(new_entries)
+        
+        vectors = np.array([cache[key] for key in keys], dtype=np.float32)
+        if prune_cache:
+            self._replace_embedding_cache({key: cache[key] for key in keys})
+        elif new_entries and len(self._embedding_cache_shards()) >= EMBEDDING_CACHE_MAX_SHARDS:
+            self._replace_embedding_cache(cache)
+        elif new_entries:
+            self._write_embedding_shard(new_entries)
+        return vectors
+    
+    def _embed_uncached(self, texts: List[str]) -> np.ndarray:
+        """Embed texts in length-sorted batches; rows are returned in input order"""
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        batches = [
+            [texts[i] for i in order[start:start + EMBED_BATCH_SIZE]]
+            for start in range(0, len(order), EMBED_BATCH_SIZE)
+        ]
+        embedded = []
+        if self.embedding_backend in IO_BOUND_EMBEDDING_BACKENDS:
+            with ThreadPoolExecutor(max_workers=EMBED_WORKERS) as executor:
+                for batch_vectors in executor.map(self.embedding_model.embed_documents, batches):
+                    embedded.extend(batch_vectors)
+        else:
+            for batch in batches:
+                embedded.extend(self.embedding_model.embed_documents(batch))
+        
+        vectors = np.empty((len(texts), len(embedded[0]) if embedded else 0), dtype=np.float32)
+        vectors[order] = embedded
+        return vectors
+    
+    def _add_to_collection(self, ids: List[str], vectors: np.ndarray, texts: List[str],
+                           metadatas: List[Dict[str, Any]]) -> None:
+        """Write pre-computed embeddings to Chroma in batches it accepts"""
+        collection = self.vector_store._collection
+        batch_size = self.vector_store._client.get_max_batch_size()
+        for start in range(0, len(ids), batch_size):
+            end = start + batch_size
+            collection.add(
+                ids=ids[start:end],
+                embeddings=vectors[start:end],
+                documents=texts[start:end],
+                metadatas=metadatas[start:end]
+            )
+    
+    def _index_paths(self) -> Tuple[str, str]:
+        """Locations of the persisted FAISS index and its row-to-id mapping"""
+        return (os.path.join(Config.VECTOR_STORE_DIR, INDEX_FILE.format(self.index_type)),
+                os.path.join(Config.VECTOR_STORE_DIR, INDEX_IDS_FILE.format(self.index_type)))
+    
+    def _new_index(self, vectors: np.ndarray) -> Any:
+        """Empty index of the configured type, trained on vectors where the type needs it"""
+        count, dim = vectors.shape
+        
+        use_ivfpq = self.index_type == "ivfpq"
+        if use_ivfpq and count < IVF_MIN_TRAINING_VECTORS:
+            logger.info(f"Corpus too small for ivfpq ({count} vectors, PQ training needs "
+                        f"{IVF_MIN_TRAINING_VECTORS}), using HNSW")
+            use_ivfpq = False
+        elif use_ivfpq and dim % IVF_PQ_M != 0:
+            logger.info(f"Embedding dimension {dim} is not divisible into {IVF_PQ_M} PQ sub-vectors, using HNSW")
+            use_ivfpq = False
+        
+        if use_ivfpq:
+            nlist = min(max(int(2 * np.sqrt(count)), 20), count // 39 or 1)
+            quantizer = faiss.IndexFlatL2(dim)
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, IVF_PQ_M, IVF_PQ_NBITS)
+            index.train(vectors)
+        elif self.index_type == "flat":
+            index = faiss.IndexFlatIP(dim)
+        elif self.index_type == "numpy":
+            index = NumpyIndex(dim)
+        elif self.index_type == "sq8":
+            index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+            # Trained on the unit-length vectors it will store
+            training = np.ascontiguousarray(vectors, dtype=np.float32).copy()
+            faiss.normalize_L2(training)
+            index.train(training)
+        else:
+            index = faiss.IndexHNSWFlat(dim, HNSW_M)
+            index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        
+        self._configure_search(index)
+        return index
+    
+    def _index_vectors(self, vectors: np.ndarray) -> np.ndarray:
+        """Vectors in the form the index stores: unit length for inner-product indexes"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if self.index is not None and self.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            vectors = vectors.copy()
+            faiss.normalize_L2(vectors)
+        return vectors
+    
+    def _configure_search(self, index: Any) -> None:
+        """Apply query-time parameters, which are not stored in index files"""
+        if hasattr(index, "hnsw"):
+            index.hnsw.efSearch = HNSW_EF_SEARCH
+        if hasattr(index, "nprobe"):
+            index.nprobe = max(1, min(index.nlist // 4, IVF_MAX_NPROBE))
+    
+    def _ensure_index(self, rebuild: bool = False) -> None:
+        """Load the persisted FAISS index, or build it from the embeddings stored in Chroma.
+        
+        On failure the index is left unset and searches fall back to Chroma.
+        """
+        try:
+            if not rebuild and self._load_index():
+                return
+            
+            data = self.vector_store._collection.get(include=["embeddings"])
+            self._build_index(list(data["ids"]), np.asarray(data["embeddings"], dtype=np.float32))
+        except Exception as e:
+            logger.warning(f"FAISS index unavailable, searching Chroma directly: {e}")
+            self.index = None
+            self.index_ids = []
+    
+    def _build_index(self, ids: List[str], vectors: np.ndarray) -> None:
+        """Build and persist the FAISS index over the given Chroma records"""
+        if not len(vectors):
+            self._reset_index()
+            return
+        
+        try:
+            self.index = self._new_index(vectors)
+            self.index.add(self._index_vectors(vectors))
+            self.index_ids = ids
+            self._save_index()
+            logger.info(f"Built FAISS {self.index_type} index over {len(ids)} embeddings")
+        except Exception as e:
+            logger.warning(f"FAISS index unavailable, searching Chroma directly: {e}")
+            self.index = None
+            self.index_ids = []
+    
+    def _load_index(self) -> bool:
+        """Load the persisted index if it was built over exactly the current collection"""
+        index_path, ids_path = self._index_paths()
+        if not (os.path.exists(index_path) and os.path.exists(ids_path)):
+            return False
+        
+        with open(ids_path, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+        # Rebuilds with the same number of chunks get new ids, so compare the
+        # ids themselves rather than counts; the index file of this type must
+        # also be the one written together with this mapping
+        collection_ids = self.vector_store._collection.get(include=[])["ids"]
+        if not isinstance(saved, dict) or saved.get("stamp") != self._index_stamp(collection_ids, index_path):
+            logger.info(f"Persisted FAISS {self.index_type} index is stale, rebuilding")
+            return False
+        ids = saved["ids"]
+        
+        if self.index_type == "numpy":
+            index = NumpyIndex(0)
+            index.vectors = np.load(index_path)
+            index.d = index.vectors.shape[1]
+        else:
+            index = faiss.read_index(index_path)
+        if index.ntotal != len(ids):
+            logger.info("Persisted FAISS index does not match its id mapping, rebuilding")
+            return False
+        
+        self._configure_search(index)
+        self.index = index
+        self.index_ids = ids
+        logger.info(f"Loaded FAISS index with {index.ntotal} embeddings")
+        return True
+    
+    def _save_index(self) -> None:
+        """Write the index and its row-to-id mapping next to the Chroma database"""
+        index_path, ids_path = self._index_paths()
+        if isinstance(self.index, NumpyIndex):
+            with open(index_path, "wb") as f:
+                np.save(f, self.index.vectors)
+        else:
+            faiss.write_index(self.index, index_path)
+        # Written last and atomically: the stamp marks a complete index
+        tmp_path = ids_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"stamp": self._index_stamp(self.index_ids, index_path), "ids": self.index_ids}, f)
+        os.replace(tmp_path, ids_path)
+    
+    def _index_stamp(self, ids: Sequence[str], index_path: str) -> str:
+        """Build stamp tying an index file of this type to the Chroma ids it covers"""
+        stat = os.stat(index_path)
+        return f"{self.index_type}:{stat.st_size}:{stat.st_mtime_ns}:{_ids_stamp(ids)}"
+    
+    def _reset_index(self) -> None:
+        """Drop the in-memory index and the persisted files of every index type"""
+        self.index = None
+        self.index_ids = []
+        for index_type in INDEX_TYPES:
+            for name in (INDEX_FILE, INDEX_IDS_FILE):
+                path = os.path.join(Config.VECTOR_STORE_DIR, name.format(index_type))
+                if os.path.exists(path):
+                    os.remove(path)
+    
+    def _add_to_index(self, ids: List[str], vectors: np.ndarray) -> None:
+        """Append newly stored Chroma records to the FAISS index"""
+        if self.index is None:
+            self._ensure_index(rebuild=True)
+            return
+        
+        try:
+            self.index.add(self._index_vectors(vectors))
+            self.index_ids.extend(ids)
+            self._save_index()
+        except Exception as e:
+            logger.warning(f"Could not extend FAISS index, rebuilding it: {e}")
+            self._ensure_index(rebuild=True)
+    
+    def _search(self, query_vector: Sequence[float], k: int) -> List[Tuple[Document, float]]:
+        """k nearest documents to an embedded query as (document, L2 distance) pairs"""
+        if self.index is None or self.index.ntotal == 0:
+            return self.vector_store.similarity_search_by_vector_with_relevance_scores(list(query_vector), k=k)
+        
+        query = self._index_vectors(np.asarray(query_vector, dtype=np.float32).reshape(1, -1))
+        distances, rows = self.index.search(query, min(k, self.index.ntotal))
+        if self.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            # Report cosine similarity as the squared L2 distance between the
+            # unit vectors, so scores mean the same for every index type
+            distances = 2.0 - 2.0 * distances
+        hits = [(self.index_ids[row], float(distance))
+                for row, distance in zip(rows[0], distances[0]) if row != -1]
+        if not hits:
+            return []
+        
+        # Fetch the hit documents from Chroma and restore the ranking order
+        data = self.vector_store._collection.get(ids=[doc_id for doc_id, _ in hits],
+                                                 include=["documents", "metadatas"])
+        documents = {
+            doc_id: Document(page_content=text, metadata=metadata or {})
+            for doc_id, text, metadata in zip(data["ids"], data["documents"], data["metadatas"])
+        }
+        results = [(documents[doc_id], distance) for doc_id, distance in hits if doc_id in documents]
+        if len(results) < len(hits):
+            logger.warning(f"Dropped {len(hits) - len(results)} of {len(hits)} FAISS hits missing from Chroma; "
+                           f"the index may be stale")
+        return results
+    
+    def _embed_queries(self, queries: List[str]) -> List[Tuple[float, ...]]:
+        """Query embeddings, computing only the uncached ones in a single batch.
+        
+        A query must get the same vector however it was batched, so batches
+        use embed_documents only where it encodes exactly like embed_query.
+        """
+        with self._query_vectors_lock:
+            vectors = {q: self._query_vectors[q] for q in queries if q in self._query_vectors}
+            for query in vectors:
+                self._query_vectors.move_to_end(query)
+        
+        missing = [q for q in dict.fromkeys(queries) if q not in vectors]
+        if missing:
+            if hasattr(self.embedding_model, "embed_queries"):
+                embedded = self.embedding_model.embed_queries(missing)
+            elif self.embedding_backend in SYMMETRIC_QUERY_BACKENDS:
+                embedded = self.embedding_model.embed_documents(missing)
+            else:
+                embedded = [self.embedding_model.embed_query(query) for query in missing]
+            computed = {query: tuple(vector) for query, vector in zip(missing, embedded)}
+            vectors.update(computed)
+            with self._query_vectors_lock:
+                self._query_vectors.update(computed)
+                while len(self._query_vectors) > QUERY_EMBEDDING_CACHE_SIZE:
+                    self._query_vectors.popitem(last=False)
+        
+        return [vectors[query] for query in queries]
+    
+    def _embed_query(self, query: str) -> Tuple[float, ...]:
+        """Embedding of one query, served from the query cache when possible"""
+        return self._embed_queries([query])[0]
+    
+    @property
+    def embedding_dimension(self) -> int:
+        """Dimension of the embedding vectors, determined once"""
+        if self._embedding_dim is None:
+            if self.index is not None:
+                self._embedding_dim = self.index.d
+            else:
+                self._embedding_dim = len(self.embedding_model.embed_query("test"))
+        return self._embedding_dim
+    
     def similarity_search(self, query: str, k: int = None) -> List[Document]:
         """Perform similarity search for a given query"""
         if self.vector_store is None:
@@ -87,16 +552,34 @@ class VectorStore:
             k = Config.TOP_K_RETRIEVAL
         
         try:
-            results = self.vector_store.similarity_search(
-                query=query,
-                k=k
-            )
+            query_vector = self._embed_query(query)
+            results = [doc for doc, _ in self._search(query_vector, k)]
             logger.info(f"Retrieved {len(results)} relevant documents for query")
             return results
         except Exception as e:
             logger.error(f"Error in similarity search: {e}")
             return []
     
+    def similarity_search_batch(self, queries: List[str], k: int = None) -> List[List[Document]]:
+        """Perform similarity search for several queries, embedding them in one batch"""
+        if self.vector_store is None:
+            raise ValueError("Vector store not initialized")
+        
+        if k is None:
+            k = Config.TOP_K_RETRIEVAL
+        
+        try:
+            query_vectors = self._embed_queries(queries)
+            results = [
+                [doc for doc, _ in self._search(vector, k)]
+                for vector in query_vectors
+            ]
+            logger.info(f"Retrieved relevant documents for {len(queries)} queries")
+            return results
+        except Exception as e:
+            logger.error(f"Error in batched similarity search: {e}")
+            return [[] for _ in queries]
+    
     def similarity_search_with_score(self, query: str, k: int = None) -> List[tuple]:
         """Perform similarity search with relevance scores"""
         if self.vector_store is None:
@@ -106,10 +589,8 @@ class VectorStore:
             k = Config.TOP_K_RETRIEVAL
         
         try:
-            results = self.vector_store.similarity_search_with_score(
-                query=query,
-                k=k
-            )
+            query_vector = self._embed_query(query)
+            results = self._search(query_vector, k)
             logger.info(f"Retrieved {len(results)} relevant documents with scores")
             return results
         except Exception as e:
@@ -128,7 +609,7 @@ class VectorStore:
             return {
                 "total_documents": count,
                 "collection_name": self.collection_name,
-                "embedding_dimension": len(self.embedding_model.embed_query("test")),
+                "embedding_dimension": self.embedding_dimension,
                 "embedding_model": Config.EMBEDDING_MODEL
             }
         except Exception as e:
@@ -141,8 +622,14 @@ class VectorStore:
             raise ValueError("Vector store not initialized")
         
         try:
-            self.vector_store.add_documents(documents)
-            self.vector_store.persist()
+            # Embed once and write the vectors directly, so neither Chroma
+            # nor the FAISS index embeds the texts again
+            texts = [doc.page_content for doc in documents]
+            vectors = self._embed_texts(texts)
+            ids = [str(uuid.uuid4()) for _ in documents]
+            self._add_to_collection(ids, vectors, texts, [doc.metadata for doc in documents])
+            self._add_to_index(ids, vectors)
+            self.generation += 1
             logger.info(f"Added {len(documents)} new documents to vector store")
         except Exception as e:
             logger.error(f"Error adding documents: {e}")
@@ -155,23 +642,32 @@ class VectorStore:
         
         try:
             self.vector_store._collection.delete()
+            self.vector_store = None
+            self._reset_index()
+            self.generation += 1
             logger.info("Collection deleted successfully")
         except Exception as e:
             logger.error(f"Error deleting collection: {e}")
     
-    def get_document_by_id(self, doc_id: str) -> Optional[Document]:
-        """Retrieve a specific document by its ID"""
+    def get_document_by_id(self, doc_id: Union[str, int]) -> Optional[Document]:
+        """Retrieve a specific document by its chunk ID"""
         if self.vector_store is None:
             return None
         
+        # chunk_id metadata is stored as an int; Chroma filters are type-exact
+        if isinstance(doc_id, str) and doc_id.isdigit():
+            doc_id = int(doc_id)
+        
         try:
-            # This is a simplified approach - in practice you might need to implement
-            # a more sophisticated ID-based retrieval system
-            results = self.vector_store.similarity_search("", k=1000)  # Get all docs
-            for doc in results:
-                if doc.metadata.get("chunk_id") == doc_id:
-                    return doc
-            return None
+            # Metadata lookup in Chroma instead of searching and scanning every document
+            result = self.vector_store._collection.get(
+                where={"chunk_id": doc_id},
+                limit=1,
+                include=["documents", "metadatas"]
+            )
+            if not result["ids"]:
+                return None
+            return Document(page_content=result["documents"][0], metadata=result["metadatas"][0] or {})
         except Exception as e:
             logger.error(f"Error retrieving document by ID: {e}")
             return None